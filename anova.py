@@ -0,0 +1,188 @@
+"""
+Two-way repeated measures ANOVA on a dense (participant, A, B)
+array, eg, the lucid dream rates of frequencies-cutoffs.py with
+evaluations as A and cutoffs as B.
+
+Sums of squares come from means over the array axes instead of
+grouping a long table, and any leading axes are treated as a
+batch, so thousands of ANOVAs (eg, over permuted arrays) run
+at once. The table matches pingouin's rm_anova (detailed, with
+generalized eta squared), including the Greenhouse-Geisser
+epsilon and corrected pvalue and Mauchly's test of sphericity
+of every effect, both from the covariance of orthonormal
+contrasts (Kronecker products of them for the interaction).
+
+The interaction also gets a permutation pvalue. Under the model
+without the interaction, what's left after removing each
+participant's A and B effects (their interaction residuals) is
+exchangeable across the A x B cells of that participant. So
+those get shuffled within participants and the interaction F
+of every shuffle is compared to the actual one.
+"""
+import numpy as np
+import pandas as pd
+
+
+ALPHA = .05 # for calling sphericity met
+
+
+#######  sums of squares and F values  #######
+
+def sums_of_squares(y):
+    """Sums of squares of the A, B and interaction effects, of their
+    error terms (participant x effect) and of participants, each
+    over the trailing (participant, A, B) axes of y."""
+    n_s, n_a, n_b = y.shape[-3:]
+    mu = y.mean(axis=(-3,-2,-1),keepdims=True)
+    mean_s = y.mean(axis=(-2,-1),keepdims=True)
+    mean_a = y.mean(axis=(-3,-1),keepdims=True)
+    mean_b = y.mean(axis=(-3,-2),keepdims=True)
+    mean_ab = y.mean(axis=-3,keepdims=True)
+    mean_as = y.mean(axis=-1,keepdims=True)
+    mean_bs = y.mean(axis=-2,keepdims=True)
+
+    def ss(deviations):
+        return (deviations**2).sum(axis=(-3,-2,-1))
+
+    ss_s  = n_a * n_b * ss(mean_s-mu)
+    ss_a  = n_b * n_s * ss(mean_a-mu)
+    ss_b  = n_a * n_s * ss(mean_b-mu)
+    ss_ab = n_s * ss(mean_ab-mean_a-mean_b+mu)
+    ss_as = n_b * ss(mean_as-mean_a-mean_s+mu)
+    ss_bs = n_a * ss(mean_bs-mean_b-mean_s+mu)
+    ss_abs = ss(y-mean_ab-mean_as-mean_bs+mean_a+mean_b+mean_s-mu)
+
+    effects = np.stack([ss_a,ss_b,ss_ab],axis=-1)
+    errors = np.stack([ss_as,ss_bs,ss_abs],axis=-1)
+    return effects, errors, ss_s
+
+def degrees_of_freedom(shape):
+    """Degrees of freedom of the A, B and interaction effects and of their errors."""
+    n_s, n_a, n_b = shape[-3:]
+    effects = np.array([n_a-1,n_b-1,(n_a-1)*(n_b-1)])
+    return effects, effects * (n_s-1)
+
+def f_values(y):
+    """F of the A, B and interaction effects (last axis) of every
+    (participant, A, B) array in y."""
+    effects, errors, _ = sums_of_squares(y)
+    ddof1, ddof2 = degrees_of_freedom(y.shape)
+    return (effects/ddof1) / (errors/ddof2)
+
+##############################################
+
+
+#######  sphericity  #######
+
+def orthonormal_contrasts(k):
+    """(k, k-1) contrasts, orthonormal and orthogonal to the mean."""
+    q, _ = np.linalg.qr(np.column_stack([np.ones(k),np.eye(k)[:,:-1]]))
+    return q[:,1:]
+
+def contrast_covariance(y):
+    """Covariance of the orthonormal contrasts of each effect,
+    from participant means over the other factor for main
+    effects and from all cells for the interaction."""
+    n_s, n_a, n_b = y.shape[-3:]
+    c_a, c_b = orthonormal_contrasts(n_a), orthonormal_contrasts(n_b)
+    c_ab = np.kron(c_a,c_b) # rows in the same order as y's flattened A x B cells
+    projections = [ y.mean(axis=-1) @ c_a, y.mean(axis=-2) @ c_b,
+        y.reshape(y.shape[:-2]+(n_a*n_b,)) @ c_ab ]
+    covariances = []
+    for z in projections:
+        z = z - z.mean(axis=-2,keepdims=True)
+        covariances.append(np.swapaxes(z,-1,-2) @ z / (n_s-1))
+    return covariances
+
+def greenhouse_geisser(m):
+    """Epsilon from the contrast covariance (1 with a single contrast)."""
+    d = m.shape[-1]
+    if d <= 1:
+        return np.ones(m.shape[:-2])
+    trace = np.trace(m,axis1=-2,axis2=-1)
+    trace_squared = np.trace(m @ m,axis1=-2,axis2=-1)
+    return np.minimum(trace**2 / (d*trace_squared),1)
+
+def mauchly(m,n_s,k):
+    """Mauchly's W and its pvalue from the contrast covariance,
+    with the chi-square approximation R (and pingouin) use,
+    k being the number of A x B cells."""
+    from scipy.stats import chi2
+    d = m.shape[-1]
+    if d <= 1:
+        return np.full(m.shape[:-2],np.nan), np.ones(m.shape[:-2])
+    df_resid = n_s - 1
+    sign, logdet = np.linalg.slogdet(m)
+    log_w = np.where(sign > 0,logdet - d*np.log(np.trace(m,axis1=-2,axis2=-1)/d),-np.inf)
+    ddof = d*(d+1)/2 - 1
+    f = 1 - (2*d**2 + d + 2) / (6*d*df_resid)
+    w2 = (d+2)*(d-1)*(d-2)*(2*d**3 + 6*d**2 + 3*k + 2) / (288*(df_resid*d*f)**2)
+    chi_squared = -df_resid * f * log_w
+    p1 = chi2.sf(chi_squared,ddof)
+    p2 = chi2.sf(chi_squared,ddof+4)
+    return np.exp(log_w), p1 + w2*(p2-p1)
+
+############################
+
+
+#######  permutations  #######
+
+def interaction_residuals(y):
+    """What's left of every participant's cells after
+    removing their A and B effects (and their mean)."""
+    return ( y - y.mean(axis=-1,keepdims=True) - y.mean(axis=-2,keepdims=True)
+        + y.mean(axis=(-2,-1),keepdims=True) )
+
+def interaction_permutations(y,n_permutations,seed):
+    """Interaction F of n_permutations shuffles of the interaction
+    residuals within each participant, all in one batch."""
+    rng = np.random.default_rng(seed)
+    n_s, n_a, n_b = y.shape
+    residuals = interaction_residuals(y).reshape(n_s,n_a*n_b)
+    # independent shuffle of every participant's cells in every permutation
+    order = rng.random((n_permutations,n_s,n_a*n_b)).argsort(axis=-1)
+    shuffled = np.take_along_axis(residuals[None],order,axis=-1)
+    return f_values(shuffled.reshape(n_permutations,n_s,n_a,n_b))[:,2]
+
+##############################
+
+
+def rm_anova(y,factors=('A','B'),n_permutations=0,seed=None):
+    """ANOVA table of one (participant, A, B) array, with the
+    same columns as pingouin's rm_anova (plus p_perm of the
+    interaction if n_permutations are given)."""
+    from scipy.stats import f as f_dist
+    n_s, n_a, n_b = y.shape
+    effects, errors, ss_s = sums_of_squares(y)
+    ddof1, ddof2 = degrees_of_freedom(y.shape)
+    ms = effects / ddof1
+    fval = ms / (errors/ddof2)
+
+    eps, w, p_spher = [], [], []
+    for m in contrast_covariance(y):
+        eps.append(greenhouse_geisser(m))
+        w_m, p_m = mauchly(m,n_s,n_a*n_b)
+        w.append(w_m)
+        p_spher.append(p_m)
+    eps, w, p_spher = np.array(eps), np.array(w,dtype=float), np.array(p_spher)
+
+    aov = pd.DataFrame({
+        'Source'     : [factors[0],factors[1],f'{factors[0]} * {factors[1]}'],
+        'SS'         : effects,
+        'ddof1'      : ddof1,
+        'ddof2'      : ddof2,
+        'MS'         : ms,
+        'F'          : fval,
+        'p_unc'      : f_dist(ddof1,ddof2).sf(fval),
+        'p_GG_corr'  : f_dist(np.maximum(ddof1*eps,1),np.maximum(ddof2*eps,1)).sf(fval),
+        'ng2'        : effects / (effects + ss_s + errors.sum(axis=-1)),
+        'eps'        : eps,
+        'sphericity' : p_spher > ALPHA,
+        'W_spher'    : w,
+        'p_spher'    : p_spher,
+    })
+    if n_permutations > 0:
+        null_f = interaction_permutations(y,n_permutations,seed)
+        p_perm = (1 + np.sum(null_f >= fval[2])) / (1 + n_permutations)
+        aov['p_perm'] = [np.nan,np.nan,p_perm]
+    return aov
@@ -0,0 +1,148 @@
+"""
+Time how long each pipeline stage takes just to start up,
+ie, to import everything it imports before doing any work.
+
+For every Python stage (and participant_descriptives.py) the
+import statements that run at startup get collected from the
+code, following the local modules it imports, and run in a
+fresh interpreter:
+    - before, the scripts as they were at a git revision (--before,
+      default is the first commit), with an interactive backend
+      (local modules get replaced by their own imports at that
+      revision, so only the libraries they loaded get timed)
+    - headless, the scripts as they are now,
+      with PHENOLL_HEADLESS=1 (like pipeline.py runs them)
+Stages that didn't exist at that revision only get the headless time.
+A bare interpreter (python -c pass) is timed too, as the floor.
+Each is the median wall time over --repeats runs.
+
+    python benchmark-startup.py                  # all stages
+    python benchmark-startup.py frequencies-agg  # just some
+"""
+from os import path
+from json import load
+import os
+import ast
+import sys
+import time
+import argparse
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+
+with open('./config.json') as f:
+    p = load(f)
+    DERIV_DIR = path.expanduser(p['derivatives_directory'])
+    FLOAT_FMT = p['float_formatting']
+
+EXPORT_FNAME = path.join(DERIV_DIR,'startup-benchmark.csv')
+
+EXTRA_SCRIPTS = ['participant_descriptives.py'] # not pipeline stages, but short
+
+parser = argparse.ArgumentParser()
+parser.add_argument('stages',nargs='*',
+    help='stages (script names, without extension) to time, default is all')
+parser.add_argument('-r','--repeats',type=int,default=5,
+    help='number of times to start each one')
+parser.add_argument('--before',default=None,
+    help='git revision to time the scripts at for comparison (default is the first commit)')
+
+
+def is_local(name):
+    return path.isfile(path.join(pipeline.CODE_DIR,name.split('.')[0]+'.py'))
+
+def read_source(fname,rev=None):
+    """Code of a file, now or at a git revision (None if it wasn't there)."""
+    if rev is None:
+        with open(path.join(pipeline.CODE_DIR,fname)) as f:
+            return f.read()
+    result = subprocess.run(['git','show',f'{rev}:./{fname}'],cwd=pipeline.CODE_DIR,
+        capture_output=True,text=True)
+    return result.stdout if result.returncode == 0 else None
+
+def import_statements(fname,rev=None,found=None):
+    """Import statements that run when a file starts, in order
+    (so not the ones inside functions). At a git revision, local
+    modules are replaced by their own imports at that revision,
+    since importing them would run their current code. None if
+    the file isn't there at that revision."""
+    found = [] if found is None else found
+    source = read_source(fname,rev)
+    if source is None:
+        return None
+    tree = ast.parse(source)
+
+    def visit(node):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child,(ast.FunctionDef,ast.AsyncFunctionDef)):
+                continue
+            if isinstance(child,ast.Import):
+                names = [ alias.name for alias in child.names ]
+            elif isinstance(child,ast.ImportFrom) and child.module:
+                names = [child.module]
+            else:
+                visit(child)
+                continue
+            statement = ast.get_source_segment(source,child)
+            if statement in found:
+                continue
+            if rev is not None and any( is_local(name) for name in names ):
+                for name in names:
+                    module_fname = name.split('.')[0] + '.py'
+                    if module_fname != fname:
+                        import_statements(module_fname,rev,found)
+                continue
+            found.append(statement)
+
+    visit(tree)
+    return found
+
+def first_commit():
+    result = subprocess.run(['git','rev-list','--max-parents=0','HEAD'],
+        cwd=pipeline.CODE_DIR,capture_output=True,text=True,check=True)
+    return result.stdout.split()[-1]
+
+def startup_time(code,headless,repeats):
+    """Median wall time of a fresh interpreter running code."""
+    env = dict(os.environ,PHENOLL_HEADLESS='1' if headless else '0')
+    env.pop('MPLBACKEND',None)
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable,'-c',code],cwd=pipeline.CODE_DIR,env=env,check=True)
+        times.append(time.perf_counter()-t0)
+    return np.median(times)
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    scripts = [ stage['script'] for stage in pipeline.STAGES
+        if stage['script'].endswith('.py') ] + EXTRA_SCRIPTS
+    if args.stages:
+        scripts = [ s for s in scripts if path.splitext(s)[0] in args.stages ]
+
+    before_rev = args.before if args.before is not None else first_commit()
+
+    baseline = startup_time('pass',True,args.repeats)
+
+    results = []
+    for script in scripts:
+        statements = import_statements(script,rev=before_rev)
+        before = ( np.nan if statements is None
+            else startup_time('\n'.join(statements),False,args.repeats) )
+        headless = startup_time('\n'.join(import_statements(script)),True,args.repeats)
+        results.append([path.splitext(script)[0],before,headless])
+        print(f'{results[-1][0]:30s} before {before:.2f}s  headless {headless:.2f}s',flush=True)
+
+    df = pd.DataFrame(results,columns=['stage','before','headless']).set_index('stage')
+    df['saving'] = df['before'] - df['headless']
+    df.loc['python'] = [baseline,baseline,0]
+
+    os.makedirs(DERIV_DIR,exist_ok=True)
+    df.to_csv(EXPORT_FNAME,float_format=FLOAT_FMT,index=True)
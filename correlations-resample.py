@@ -16,96 +16,192 @@ where for every iteration, one sample is drawn randomly
 per subject and a normal correlation is run across
 points (bc now there is only one datapoint per subject).
 For each dream characteristic, run N iterations.
+All N random draws are made at once as a matrix of
+row indices (see resampling.py), so the data for
+every resample is gathered without any groupby calls.
+
+Resamples are split into blocks that each get their own
+random generator, so with --jobs N the blocks can be
+spread over N processes and still give identical output.
+Those aren't the draws of the original groupby/sample
+version of this script, so with --legacy-draws all draws
+are made up front from its random stream instead (slower,
+serial and all in memory), which gives back its exact
+correlates.csv for the same seed.
+
+With --adaptive, the number of resamples is picked per
+variable instead of fixed, drawing blocks until the Monte
+Carlo error of the fisher z mean, CI bounds and pvalue is
+below the tolerance (or the max is hit).
+
+Resampled results are streamed to disk block by block
+(see resampling.ResampleStore) with a checkpoint every
+few seconds, and --resume continues an interrupted run
+from the last one.
+The csv is written once everything is done.
+
+With --fused, skip correlates.csv and the separate
+correlations-zscore.py step. Each block of resamples is
+fed straight into running per-variable stats (including
+a quantile sketch for the CI bounds) that are exported
+as correlates-stats.csv, so no resample table is kept.
+
+With --exact, skip the resampling and instead compute the
+expected tau (and its variance) over every possible draw,
+as a deterministic cross-check of the resampled tau_mean.
 
 Fisher zscoring and pvalues come from correlations-zscore.py
 
+The data handling shared by the correlation scripts is in
+correlations.py, and the resampling itself in resampling.py
+
 Export dataframe holding all the resampled correlations
 """
 from os import path
 from json import load
+import argparse
 import tqdm
 
-import numpy as np
 import pandas as pd
 
-np.random.seed(72) # for reproducibility
+import correlations
+import resampling
+
+SEED = correlations.SEED
 
 
 #########  parameter setup  #########
 
 with open('./config.json') as f:
     p = load(f)
-    DATA_DIR  = path.expanduser(p['data_directory'])
     DERIV_DIR = path.expanduser(p['derivatives_directory'])
-    POS_PROBES = p['PANAS_positive_probes']
-    NEG_PROBES = p['PANAS_negative_probes']
-    CONTROL_PROBES = p['DLQ_control_probes']
     N_RESAMPLES = p['n_correlation_resamples']
+    TOLERANCE = p['correlation_resample_tolerance']
+    MAX_RESAMPLES = p['max_correlation_resamples']
     FLOAT_FMT = p['float_formatting']
 
-IMPORT_FNAME = path.join(DATA_DIR,'data.csv')
 EXPORT_FNAME = path.join(DERIV_DIR,'correlates.csv')
+EXPORT_FNAME_EXACT = path.join(DERIV_DIR,'correlates-exact.csv')
+EXPORT_FNAME_STATS = path.join(DERIV_DIR,'correlates-stats.csv')
+STORE_DIR = path.join(DERIV_DIR,'correlates-resamples')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-j','--jobs',type=int,default=1,
+    help='number of processes to spread the resamples over')
+parser.add_argument('--adaptive',action='store_true',
+    help='draw resamples until the results converge')
+parser.add_argument('--resume',action='store_true',
+    help='continue an interrupted run from its last checkpoint')
+parser.add_argument('--fused',action='store_true',
+    help='compute the final stats on the fly without saving resamples')
+parser.add_argument('--exact',action='store_true',
+    help='compute the exact expected tau instead of resampling')
+parser.add_argument('--legacy-draws',action='store_true',
+    help='draw like the original script, to reproduce its correlates.csv')
 
 ######################################
 
 
-#######  load and manipulate data  #######
+# guard so worker processes can import this file without rerunning it
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.fused and (args.adaptive or args.resume):
+        parser.error('--fused can not be combined with --adaptive or --resume')
+    if args.legacy_draws and (args.adaptive or args.fused or args.exact):
+        parser.error('--legacy-draws only works with a fixed number of resamples')
+
+
+    #######  load and manipulate data  #######
+
+    # pick columns to run correlation on,
+    # and load them (and generate the derived ones)
+    cols2corr = correlations.probes()
+    df = correlations.load_data()
 
-df = pd.read_csv(IMPORT_FNAME)
 
-# drop all nights without recall
-df.dropna(subset=['dream_report'],axis=0,inplace=True)
+    #######  analysis  #######
 
-# pick columns to run correlation on
-cols2corr = [ col for col in df.columns if 'CHAR' in col ]
-cols2corr.append('PANAS_pos')
-cols2corr.append('PANAS_neg')
-cols2corr.append('sleep_quality')
-cols2corr.append('dream_control')
+    # group nights by participant once for each variable of interest
+    data = correlations.probe_data(df,cols2corr)
 
-# generate columns that require manipulations of the raw data
-panas_pos_cols = [ f'PANAS_{x:02d}' for x in POS_PROBES ]
-panas_neg_cols = [ f'PANAS_{x:02d}' for x in NEG_PROBES ]
-control_cols   = [ f'DLQ_{x:02d}' for x in CONTROL_PROBES ]
-df['PANAS_pos']     = df[panas_pos_cols].sum(axis=1)
-df['PANAS_neg']     = df[panas_neg_cols].sum(axis=1)
-df['dream_control'] = df[control_cols].mean(axis=1)
+    if args.exact:
+        # expected tau over every possible draw, no resampling
+        exact_df = correlations.exact(data,cols2corr)
+        exact_df.to_csv(EXPORT_FNAME_EXACT,float_format=FLOAT_FMT,index=True)
 
+    elif args.fused:
+        # update each variable's stats with every block of resamples
+        accumulators = [ resampling.StreamingStats() for _ in cols2corr ]
+        with resampling.BlockRunner(data,SEED,n_jobs=args.jobs) as runner:
+            blocks = resampling.make_blocks(len(cols2corr),N_RESAMPLES)
+            block_results = runner.map(blocks)
+            for (k,b,n), block_res in tqdm.tqdm(zip(blocks,block_results),
+                    total=len(blocks),desc='resample blocks'):
+                accumulators[k].update(block_res)
 
-#######  analysis  #######
+        stats_df = pd.DataFrame([ acc.summary() for acc in accumulators ],
+            index=pd.Index(cols2corr,name='probe'))
+        n_resamples = pd.Series([ acc.n for acc in accumulators ],index=stats_df.index)
+        stats_df = resampling.finish_stats(stats_df,n_resamples,
+            correlations.read_exact(EXPORT_FNAME_EXACT,data))
 
-# build dataframe to hold all the resampled correlations
-METRICS = ['slope','intercept','tau']
-INDEX_NAMES = ['probe','resample']
-index_values = [cols2corr,range(N_RESAMPLES)]
-index = pd.MultiIndex.from_product(index_values,names=INDEX_NAMES)
-res_df = pd.DataFrame(columns=METRICS,index=index,dtype=float)
+        stats_df.to_csv(EXPORT_FNAME_STATS,float_format=FLOAT_FMT,index=True)
 
-# loop over each variable of interest and run N
-# correlations, resampling a random night from
-# each participant every time
-for col in tqdm.tqdm(cols2corr,desc='variables of interest'):
-    # if it's one of the CHAR columns, then the
-    # 0 option is "no recall" so take that out
-    if 'CHAR' in col:
-        subdf = df[ df[col] > 0 ]
     else:
-        subdf = df
-    for i in tqdm.trange(N_RESAMPLES,desc='resamples',leave=False):
-        # sample one night from each subject, randomly
-        rsmpl_df = subdf.groupby('participant_id').apply(
-            lambda df: df.sample(1))[['DLQ_01',col]]
-        # correlate col/var with DLQ1
-        r = rsmpl_df.corr(method='kendall').values[0,1]
-        # get the slope/intercept for later plotting
-        x = rsmpl_df[col].values
-        y = rsmpl_df['DLQ_01'].values
-        m, b = np.polyfit(x,y,1)
-        # save to dataframe
-        res_df.loc[(col,i),METRICS] = [m,b,r]
-
-
-# export
-res_df.to_csv(EXPORT_FNAME,float_format=FLOAT_FMT,index=True)
+        METRICS = resampling.METRICS
+        INDEX_NAMES = correlations.INDEX_NAMES
+
+        if args.legacy_draws:
+            resampling.add_legacy_draws(data,SEED,N_RESAMPLES)
+
+        # everything that determines the resampled values, so
+        # a run can only be resumed with the same settings
+        settings = dict(seed=SEED,block_size=resampling.BLOCK_SIZE,
+            probes=cols2corr,data=resampling.data_hash(data),
+            adaptive=args.adaptive,legacy_draws=args.legacy_draws)
+        if args.adaptive:
+            settings.update(tolerance=TOLERANCE,max_resamples=MAX_RESAMPLES)
+        else:
+            settings.update(n_resamples=N_RESAMPLES)
+
+        # results get streamed to disk block by block
+        store = resampling.ResampleStore(STORE_DIR,settings,resume=args.resume)
+
+        if not store.finished:
+            with resampling.BlockRunner(data,SEED,n_jobs=args.jobs) as runner:
+
+                if args.adaptive:
+                    # keep resampling each variable of interest until
+                    # its statistics are stable, up to a maximum
+                    resampling.run_adaptive(runner,len(cols2corr),
+                        TOLERANCE,MAX_RESAMPLES,store)
+
+                else:
+                    # run N correlations for each variable of interest,
+                    # resampling a random night from each participant
+                    # every time, in blocks of resamples
+                    blocks = [ block for block in
+                        resampling.make_blocks(len(cols2corr),N_RESAMPLES)
+                        if block[:2] not in store.completed ]
+                    block_results = runner.map(blocks)
+                    for (k,b,n), block_res in tqdm.tqdm(zip(blocks,block_results),
+                            total=len(blocks),desc='resample blocks'):
+                        store.append(k,b,block_res)
+
+            store.finish()
+
+
+        # export, one variable at a time so the
+        # full resample table is never in memory
+        for k, col in enumerate(cols2corr):
+            results = store.read_probe(k)
+            index_values = [[col],range(len(results))]
+            index = pd.MultiIndex.from_product(index_values,names=INDEX_NAMES)
+            res_df = pd.DataFrame(results,columns=METRICS,index=index)
+            res_df.to_csv(EXPORT_FNAME,float_format=FLOAT_FMT,index=True,
+                mode='w' if k == 0 else 'a',header=k==0)
 
 ##################################
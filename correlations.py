@@ -0,0 +1,282 @@
+"""
+The correlation analysis, as functions that take and return
+DataFrames (see the correlations-*.py scripts for what each step
+is for). The scripts are thin wrappers that load and save the
+csv files in between, while pipeline.py --in-process chains
+these functions in memory, so the resampled values never get
+rounded to float_formatting between steps.
+
+Plotting functions import matplotlib only when called, so the
+analysis can be imported without it.
+"""
+from os import path
+
+import numpy as np
+import pandas as pd
+
+import dataset
+import resampling
+
+
+SEED = 72 # for reproducibility
+
+INDEX_NAMES = ['probe','resample']
+
+# choose params to make 95% confidence intervals
+CI_LO = .025
+CI_HI = .975
+
+XLABEL_DICT = {
+    'CHAR_sensory'       : 'Dream sensory vividness',
+    'CHAR_bizarreness'   : 'Dream bizarreness',
+    'CHAR_neg_emo'       : 'Dream negative emotion',
+    'CHAR_neg_body'      : 'Dream negative body',
+    'CHAR_neg_mood'      : 'Awakening negative mood',
+    'CHAR_pos_emo'       : 'Dream positive emotion',
+    'CHAR_pos_body'      : 'Dream positive body',
+    'CHAR_pos_mood'      : 'Awakening positive mood',
+    'PANAS_pos'          : 'Positive morning affect',
+    'PANAS_neg'          : 'Negative morning affect',
+    'dream_control'      : 'Dream control',
+    'sleep_quality'      : 'Subjective sleep quality'
+}
+
+
+#########  data  #########
+
+def probes():
+    """Columns to run correlations on (with DLQ1)."""
+    cols2corr = [ col for col in dataset.columns() if 'CHAR' in col ]
+    cols2corr.append('PANAS_pos')
+    cols2corr.append('PANAS_neg')
+    cols2corr.append('sleep_quality')
+    cols2corr.append('dream_control')
+    return cols2corr
+
+def load_data(float_likert=False):
+    """Nights with recall and the columns to correlate
+    (the composite scales come scored from dataset.py)."""
+    load_cols = ['participant_id','dream_report','DLQ_01'] + probes()
+    df = dataset.load_data(columns=dict.fromkeys(load_cols),float_likert=float_likert)
+
+    # drop all nights without recall
+    df.dropna(subset=['dream_report'],axis=0,inplace=True)
+    return df
+
+def probe_rows(df,col):
+    """The nights to use for one probe."""
+    # if it's one of the CHAR columns, then the
+    # 0 option is "no recall" so take that out
+    if 'CHAR' in col:
+        return df[ dataset.to_float(df[col]) > 0 ]
+    return df
+
+def probe_data(df,cols2corr):
+    """Group nights by participant once for each variable of interest."""
+    data = []
+    for col in cols2corr:
+        subdf = probe_rows(df,col)
+        data.append(resampling.probe_data(np.asarray(subdf['participant_id']),
+            dataset.to_float(subdf[col]),dataset.to_float(subdf['DLQ_01'])))
+    return data
+
+##########################
+
+
+#########  analysis  #########
+
+def resample(data,cols2corr,n_resamples,n_jobs=1):
+    """
+    Run N correlations for each variable of interest,
+    resampling a random night from each participant every
+    time, all in memory. Same blocks and random generators as
+    correlations-resample.py, so the same values too.
+    """
+    blocks = resampling.make_blocks(len(cols2corr),n_resamples)
+    with resampling.BlockRunner(data,SEED,n_jobs=n_jobs) as runner:
+        results = np.concatenate(list(runner.map(blocks)))
+    index_values = [cols2corr,range(n_resamples)]
+    index = pd.MultiIndex.from_product(index_values,names=INDEX_NAMES)
+    return pd.DataFrame(results,columns=resampling.METRICS,index=index)
+
+def data_hash(data):
+    """Fingerprint of the nights of every probe (not of any draws)."""
+    return resampling.data_hash([ { key: probe[key]
+        for key in ('x','y','starts','counts') } for probe in data ])
+
+def exact(data,cols2corr):
+    """Expected tau (and its variance) over every possible draw,
+    with a hash of the data it came from (see read_exact)."""
+    exact = [ resampling.exact_kendall(probe) for probe in data ]
+    exact_df = pd.DataFrame(exact,columns=['tau_exact','tau_exact_var'],
+        index=pd.Index(cols2corr,name='probe'))
+    exact_df['data_hash'] = data_hash(data)
+    return exact_df
+
+def read_exact(fname,data):
+    """Exact taus saved by correlations-resample.py --exact, if
+    there and computed from the same data (else they're ignored)."""
+    if not path.isfile(fname):
+        return None
+    exact_df = pd.read_csv(fname,index_col='probe')
+    if 'data_hash' not in exact_df or (exact_df['data_hash'] != data_hash(data)).any():
+        print(f'Ignoring {fname}, it was computed from other data '
+            '(rerun correlations-resample.py --exact)')
+        return None
+    return exact_df.drop(columns='data_hash')
+
+def add_fisherz(res_df):
+    # fisher zscore all r values at once
+    res_df = res_df.copy()
+    res_df['fishz'] = resampling.fisherz(res_df['tau'].values)
+    return res_df
+
+def correlation_stats(res_df,exact_df=None):
+    """Means, fisherz confidence intervals and (corrected)
+    pvalues of every probe, ordered by correlation effect."""
+    stats_df, n_resamples = resampling.resample_stats(res_df,quantiles=(CI_LO,CI_HI))
+    return resampling.finish_stats(stats_df,n_resamples,exact_df)
+
+##############################
+
+
+#########  plots  #########
+
+def plot_correlations(datadf,statdf,fname):
+    """Swarmplots of DLQ1 by each variable, with the regression line."""
+    import pyplotparams as myplt
+    import seaborn as sea
+    import matplotlib.pyplot as plt
+    from matplotlib import ticker as mticker
+
+    PALETTE = { x: myplt.dlqcolor(x) for x in myplt.DLQ_STRINGS.keys() }
+
+    xlims_dict = {}
+    for key in XLABEL_DICT.keys():
+        if 'CHAR' in key:
+            xlim = (1,9)
+        elif 'PANAS' in key:
+            xlim = (0,30)
+        elif key == 'dream_control':
+            xlim = (0,4)
+        elif key == 'sleep_quality':
+            xlim = (1,7)
+        xlims_dict[key] = xlim
+
+    # extract all the columns/variables that we correlated
+    correlated_vars = statdf.index
+    # one subplot/axis for each variables
+    n_axes = len(correlated_vars)
+    n_rows = 3
+    n_cols = int(np.ceil(n_axes/n_rows))
+    height = 1.5 * n_rows
+    width = 1.5 * n_cols
+
+    fig, axes = plt.subplots(n_rows,n_cols,figsize=(width,height),
+                             squeeze=False,sharex=False,sharey=False)
+
+    for ax, var in zip(axes.flat,correlated_vars):
+
+        xmin, xmax = xlims_dict[var]
+        xlabel = XLABEL_DICT[var]
+
+        # scatterplot
+        plotdf = probe_rows(datadf,var)
+        sea.swarmplot(y='DLQ_01',x=var,data=plotdf,
+            size=4,linewidth=1,#jitter=.2,
+            palette=PALETTE,orient='h',ax=ax)
+
+        ax.invert_yaxis()
+        ax.set_yticks(range(0,5))
+        ax.set_ylim(-.5,4.5)
+        ax.set_xticks([xmin,xmax])
+        ax.set_xlabel(xlabel)
+        if xmax > 10:
+            ax.xaxis.set_minor_locator(mticker.MultipleLocator(5))
+            ax.set_xlim(xmin-2,xmax+2)
+        else:
+            ax.xaxis.set_minor_locator(mticker.MultipleLocator(1))
+            ax.set_xlim(xmin-.5,xmax+.5)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.grid(True,axis='y',which='major',linestyle='--',linewidth=.25,color='k',alpha=1)
+        if ax == axes.flat[0]:
+            ax.set_ylabel('Lucidity')
+            ax.set_yticklabels(list(myplt.DLQ_STRINGS.values()),rotation=25)
+        else:
+            ax.set_ylabel('')
+            ax.set_yticklabels([])
+            for tic in ax.yaxis.get_major_ticks():
+                tic.tick1line.set_visible(False)
+                tic.tick2line.set_visible(False)
+
+        slope, intercept = statdf.loc[var,['slope_mean','intercept_mean']]
+        x = np.arange(xmin,xmax+1)
+        line = slope*x + intercept
+        ax.plot(x,line,color='k',linewidth=1)
+
+    # clear the last axis if it's empty
+    if n_axes % 2 != 0:
+        ax = axes.flat[-1]
+        ax.clear()
+        for x in ['left','right','top','bottom']:
+            ax.spines[x].set_visible(False)
+        ax.set_xticks([]); ax.set_yticks([])
+
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+def plot_fisherz(rsmpdf,statdf,fname):
+    """Distribution of the fisherz tau values of each variable."""
+    import pyplotparams as myplt
+    import matplotlib.pyplot as plt
+    from matplotlib import ticker as mticker
+
+    correlated_vars = statdf.index
+    n_violins = len(correlated_vars)
+    width = .4 * n_violins
+    fig, ax = plt.subplots(figsize=(width,2.2))
+
+    ymin, ymax = -1.2, 2.2
+
+    violin_data = [ rsmpdf.loc[var,'fishz'].values for var in correlated_vars ]
+    viols = ax.violinplot(violin_data,positions=range(n_violins),
+                          widths=np.repeat(.5,n_violins),
+                          showextrema=False)
+    plt.setp(viols['bodies'],facecolor='gainsboro',edgecolor='white',alpha=1)
+
+    # add error bars of 95% CI
+    for x, var in enumerate(correlated_vars):
+        ci = statdf.loc[var,['fishz_cilo','fishz_cihi']].values
+        y = statdf.loc[var,'fishz_mean']
+        yerr = abs( ci.reshape(2,1) - y )
+        ax.errorbar(x,y,yerr,marker='o',color='k',markersize=1,
+                    capsize=1,capthick=0,linewidth=.5)
+        # significance markers
+        ymark = ymax - .2
+        p, pcorr = statdf.loc[var,['pval','pval_corrected']]
+        if p < .05:
+            ax.plot(x,ymark,marker='*',fillstyle='none',color='k',markersize=5,mew=.7)
+        elif p < .1:
+            ax.plot(x,ymark,marker='^',fillstyle='none',color='k',markersize=5,mew=.7)
+
+    ax.axhline(0,linestyle='--',linewidth=.25,color='k')
+
+    ax.set_ylabel('Correlation with lucidity\n($\\tau$ $\\it{z}$-score)')
+    ax.set_ylim(ymin,ymax)
+    ax.yaxis.set_major_locator(mticker.MultipleLocator(1))
+    ax.yaxis.set_minor_locator(mticker.MultipleLocator(.25))
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    ax.set_xticks(range(n_violins))
+    xticklabels = [ XLABEL_DICT[var] for var in correlated_vars ]
+    ax.set_xticklabels(xticklabels,rotation=25,ha='right')
+    ax.set_xlim(-.5,n_violins-.5)
+
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+###########################
@@ -0,0 +1,261 @@
+"""
+Shared loader for the cleaned data.
+
+data.csv is the plain text version of the data, but parsing
+it with default dtypes gives float Likert responses and
+makes every script read every column. So xls2csv.py also
+saves a typed columnar copy (data.parquet) with:
+    - Likert responses (PANAS/DLQ/MUSK/CHAR) as nullable uint8,
+      so nights without a response (eg, DLQ_01 on nights
+      without recall) stay missing rather than turning to float
+    - participant_id and night_id as categoricals
+    - the composite scales declared in config.json (eg, PANAS_pos),
+      scored once here so every script gets the same values
+
+All scripts load data through load_data, which only reads the
+columns asked for. It uses data.parquet when it is at least
+as new as data.csv, and otherwise falls back to parsing
+data.csv with the same dtypes.
+
+Each composite scale names its Likert block, the probe numbers
+in it (or the config key listing them) and whether items get
+summed or averaged. All scales are scored together, with one
+product of the Likert responses and a sparse (items x scales)
+weight matrix. Missing responses are skipped, like pandas does.
+
+Next to it goes likert_counts.npz, a (participant x item x level)
+tensor with how many nights each participant gave each response
+to each Likert item (and, in the last level, how many nights
+they skipped it). Per-participant frequencies and item
+descriptives are sums over this, so they don't rescan the data.
+It's built with one bincount pass over the uint8 Likert matrix.
+
+Run this file directly to (re)build data.parquet and
+likert_counts.npz from an existing data.csv.
+"""
+from os import path
+from json import load, dumps
+
+import numpy as np
+import pandas as pd
+
+
+with open('./config.json') as f:
+    p = load(f)
+    DATA_DIR = path.expanduser(p['data_directory'])
+    COMPOSITE_SCALES = p['composite_scales']
+    for scale in COMPOSITE_SCALES.values():
+        # probes can be listed in place or by the config key that has them
+        probes = p[scale['probes']] if isinstance(scale['probes'],str) else scale['probes']
+        scale['items'] = [ f'{scale["block"]}_{x:02d}' for x in probes ]
+
+CSV_FNAME = path.join(DATA_DIR,'data.csv')
+CACHE_FNAME = path.join(DATA_DIR,'data.parquet')
+COUNTS_FNAME = path.join(DATA_DIR,'likert_counts.npz')
+# participants whose nights changed in the last xls2csv.py run
+UPDATED_FNAME = path.join(DATA_DIR,'data-updated_participants.txt')
+
+# every block of Likert columns (by column prefix) and its
+# number of response levels, once shifted to start at 0
+# (for CHAR, 0 is "no recall" and the scale is 1-9)
+LIKERT_BLOCKS = dict(PANAS=5,DLQ=5,MUSK=5,CHAR=10)
+CATEGORICAL_COLS = ['participant_id','night_id']
+# levels in the count tensor, the last one counts missing responses
+N_COUNT_LEVELS = max(LIKERT_BLOCKS.values()) + 1
+COMPOSITE_ITEMS = sorted({ item for scale in COMPOSITE_SCALES.values() for item in scale['items'] })
+# saved with data.parquet, which is outdated if the scales change
+SCALES_METADATA_KEY = b'composite_scales'
+
+
+def likert_block(col):
+    """Prefix of the Likert block a column is in (or None)."""
+    prefix = col.split('_')[0]
+    if col in COMPOSITE_SCALES or prefix not in LIKERT_BLOCKS:
+        return None
+    return prefix
+
+def is_likert(col):
+    return likert_block(col) is not None
+
+def scales_spec():
+    return dumps(COMPOSITE_SCALES,sort_keys=True).encode()
+
+def cache_is_current():
+    """True if data.parquet exists, is not older than data.csv
+    and has the composite scales currently in config.json"""
+    if not path.isfile(CACHE_FNAME):
+        return False
+    if path.isfile(CSV_FNAME) and path.getmtime(CACHE_FNAME) < path.getmtime(CSV_FNAME):
+        return False
+    import pyarrow.parquet as pq
+    metadata = pq.read_schema(CACHE_FNAME).metadata or {}
+    return metadata.get(SCALES_METADATA_KEY) == scales_spec()
+
+def columns():
+    """All column names, without loading any data."""
+    if cache_is_current():
+        import pyarrow.parquet as pq
+        return pq.read_schema(CACHE_FNAME).names
+    return pd.read_csv(CSV_FNAME,nrows=0).columns.tolist() + list(COMPOSITE_SCALES)
+
+def composite_weights():
+    """Sparse (items x scales) matrix, 1 where an item is in a scale."""
+    from scipy import sparse
+    item_index = { item: i for i, item in enumerate(COMPOSITE_ITEMS) }
+    rows, cols = zip(*[ (item_index[item], j)
+        for j, scale in enumerate(COMPOSITE_SCALES.values()) for item in scale['items'] ])
+    return sparse.csc_matrix((np.ones(len(rows)),(rows,cols)),
+        shape=(len(COMPOSITE_ITEMS),len(COMPOSITE_SCALES)))
+
+def add_composites(df):
+    """Score all the composite scales at once (as float columns)."""
+    values = df[COMPOSITE_ITEMS].to_numpy(dtype=float,na_value=np.nan)
+    answered = ~np.isnan(values)
+    weights = composite_weights()
+    totals = np.asarray(np.where(answered,values,0) @ weights)
+    n_items = np.asarray(answered.astype(float) @ weights)
+    for j, (name, scale) in enumerate(COMPOSITE_SCALES.items()):
+        if scale['score'] == 'sum':
+            df[name] = totals[:,j]
+        elif scale['score'] == 'mean':
+            with np.errstate(invalid='ignore'):
+                df[name] = totals[:,j] / n_items[:,j]
+        else:
+            raise ValueError(f'Unknown score {scale["score"]} for composite scale {name}')
+    return df
+
+def read_csv(columns=None):
+    """Parse data.csv into the typed columns."""
+    header = pd.read_csv(CSV_FNAME,nrows=0).columns
+    likert_dtypes = { col: 'UInt8' for col in header if is_likert(col) }
+    if columns is not None:
+        # composites aren't in the csv, so read the items they need
+        columns = [ col for col in columns if col not in COMPOSITE_SCALES ] + COMPOSITE_ITEMS
+        columns = list(dict.fromkeys(columns))
+    df = pd.read_csv(CSV_FNAME,usecols=columns,dtype=likert_dtypes)
+    return add_composites(set_categoricals(df))
+
+def set_categoricals(df):
+    # made after reading so numeric ids keep numeric
+    # categories (and sorting), parquet doesn't keep those
+    for col in CATEGORICAL_COLS:
+        if col in df and df[col].dtype.name != 'category':
+            df[col] = df[col].astype('category')
+    return df
+
+def write_cache():
+    """Save the typed columnar copy of data.csv.
+
+    Built from the csv itself (not the dataframe that
+    wrote it) so both files always hold the same values.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    df = read_csv()
+    table = pa.Table.from_pandas(df,preserve_index=False)
+    metadata = { **(table.schema.metadata or {}), SCALES_METADATA_KEY: scales_spec() }
+    pq.write_table(table.replace_schema_metadata(metadata),CACHE_FNAME)
+    LikertCounts.from_data(df).save(COUNTS_FNAME)
+
+def load_data(columns=None,float_likert=False):
+    """Load the cleaned data, only the columns given (or all).
+
+    With float_likert the Likert columns come back as
+    float64 with NaNs, for plotting or anything else
+    that doesn't handle nullable integers.
+    """
+    if columns is not None:
+        columns = list(columns)
+    if cache_is_current():
+        df = set_categoricals(pd.read_parquet(CACHE_FNAME,columns=columns))
+    else:
+        df = read_csv(columns)
+    if columns is not None:
+        df = df[columns]
+    if float_likert:
+        likert_cols = [ col for col in df.columns if is_likert(col) ]
+        df[likert_cols] = df[likert_cols].astype(float)
+    return df
+
+class LikertCounts:
+    """Count tensor of Likert responses, with counts[p,i,level]
+    the number of nights participant p gave item i that
+    response (level N_COUNT_LEVELS-1 is no response)."""
+
+    def __init__(self,counts,participants,items):
+        self.counts = counts
+        self.participants = pd.Index(participants,name='participant_id')
+        self.items = list(items)
+
+    @classmethod
+    def from_data(cls,df):
+        items = [ col for col in df.columns if is_likert(col) ]
+        participants = df['participant_id'].cat.remove_unused_categories()
+        # missing responses go in the last level
+        levels = df[items].fillna(N_COUNT_LEVELS-1).to_numpy(dtype=np.uint8)
+        n_pps, n_items = len(participants.cat.categories), len(items)
+        cells = participants.cat.codes.to_numpy().astype(np.intp)[:,None] * n_items + np.arange(n_items)
+        counts = np.bincount((cells*N_COUNT_LEVELS + levels).ravel(),
+            minlength=n_pps*n_items*N_COUNT_LEVELS)
+        return cls(counts.reshape(n_pps,n_items,N_COUNT_LEVELS),
+            participants.cat.categories,items)
+
+    @classmethod
+    def load(cls,fname):
+        with np.load(fname) as npz:
+            return cls(npz['counts'],npz['participants'],npz['items'])
+
+    def save(self,fname):
+        np.savez(fname,counts=self.counts,
+            participants=self.participants.to_numpy(),items=np.array(self.items))
+
+    def item(self,col,participants=None):
+        """Counts of one item, participants by response level
+        (the block's levels, then 'NA' for no response)."""
+        n_levels = LIKERT_BLOCKS[likert_block(col)]
+        counts = self.counts[:,self.items.index(col),:]
+        df = pd.DataFrame(np.column_stack([counts[:,:n_levels],counts[:,-1]]),
+            index=self.participants,columns=list(range(n_levels))+['NA'])
+        if participants is not None:
+            df = df[df.index.isin(participants)]
+        return df
+
+    def totals(self,cols):
+        """Counts of some items (of the same block) over all
+        participants, items by response level."""
+        n_levels = LIKERT_BLOCKS[likert_block(cols[0])]
+        item_index = [ self.items.index(col) for col in cols ]
+        return pd.DataFrame(self.counts[:,item_index,:n_levels].sum(axis=0),
+            index=pd.Index(cols,name='probe'),columns=range(n_levels))
+
+def histograms(df,cols):
+    """(item x level) counts of some Likert columns (of the
+    same block) over all rows of df, missing ones left out."""
+    n_levels = LIKERT_BLOCKS[likert_block(cols[0])]
+    # missing responses go in an extra level that gets dropped
+    levels = df[cols].fillna(n_levels).to_numpy(dtype=np.uint8)
+    cells = np.arange(len(cols))*(n_levels+1) + levels
+    counts = np.bincount(cells.ravel(),minlength=len(cols)*(n_levels+1))
+    return counts.reshape(len(cols),n_levels+1)[:,:n_levels]
+
+def load_counts():
+    """The Likert count tensor, from likert_counts.npz if it's
+    up to date or else counted from the data."""
+    if ( cache_is_current() and path.isfile(COUNTS_FNAME)
+        and path.getmtime(COUNTS_FNAME) >= path.getmtime(CACHE_FNAME) ):
+        return LikertCounts.load(COUNTS_FNAME)
+    likert_cols = [ col for col in columns() if is_likert(col) ]
+    return LikertCounts.from_data(load_data(columns=['participant_id']+likert_cols))
+
+def updated_participants():
+    """Participants changed by the last xls2csv.py run."""
+    with open(UPDATED_FNAME) as f:
+        return [ int(x) if x.isdigit() else x for x in f.read().split() ]
+
+def to_float(series):
+    """Plain float64 values of a (possibly nullable) column."""
+    return series.to_numpy(dtype=float,na_value=np.nan)
+
+
+if __name__ == '__main__':
+    write_cache()
@@ -7,27 +7,32 @@ Draw boxplots for the DLQ (on with all dreams,
     other with just nonzero lucidity dreams).
 Construct descriptives table with means/medians/etc.
 
-Generate plot and table simultaneously, since the plot uses raw data anyways.
+Generate plot and table simultaneously, both from histograms
+of the responses to every probe. Since the Likert levels are
+fixed (0-4), counts, means, sds, quartiles and everything the
+boxplots need can all be worked out from the histograms,
+without going back to the raw responses. The histograms
+of each set of dreams come from one bincount (see dataset.py).
 """
 from os import path
 from json import load
+import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt; plt.ion()
+import dataset
+
 import pyplotparams as myplt
+import matplotlib.pyplot as plt; myplt.ion()
 
 
 ###########  parameter setup  ###########
 
 with open('./config.json') as f:
     p = load(f)
-    DATA_DIR  = path.expanduser(p['data_directory'])
     DERIV_DIR = path.expanduser(p['derivatives_directory'])
     DLQ_STRINGS = p['DLQ_probes']
     FLOAT_FMT = p['float_formatting']
 
-DATA_FNAME = path.join(DATA_DIR,'data.csv')
-
 PLOT_FNAME  = path.join(DERIV_DIR,'dlq.eps')
 TABLE_FNAME = path.join(DERIV_DIR,'dlq.csv')
 
@@ -51,17 +56,74 @@ BOX_ARGS = {
 ###########################################
 
 
+###########  histogram stats  ###########
+
+N_LEVELS = 5
+# float, so whiskers clipped to the (interpolated) quartiles stay float
+LEVELS = np.arange(N_LEVELS,dtype=float)
+
+def quantiles(hists,q):
+    """Quantile of each row of (probe x level) counts,
+    interpolated like pandas and matplotlib do."""
+    position = q * (hists.sum(axis=1)-1)
+    cumsum = hists.cumsum(axis=1)
+    # the i-th smallest response is the first level with more than i below it
+    nth_value = lambda i: (cumsum <= i[:,None]).sum(axis=1)
+    lo = nth_value(np.floor(position))
+    hi = nth_value(np.ceil(position))
+    return lo + (position-np.floor(position)) * (hi-lo)
+
+def describe(hists,index):
+    """Same stats as pandas describe, from (probe x level) counts."""
+    n = hists.sum(axis=1)
+    mean = hists @ LEVELS / n
+    std = np.sqrt( (hists * (LEVELS-mean[:,None])**2).sum(axis=1) / (n-1) )
+    answered = hists > 0
+    return pd.DataFrame({
+        'count' : n.astype(float),
+        'mean'  : mean,
+        'std'   : std,
+        'min'   : answered.argmax(axis=1).astype(float),
+        '25%'   : quantiles(hists,.25),
+        '50%'   : quantiles(hists,.5),
+        '75%'   : quantiles(hists,.75),
+        'max'   : (N_LEVELS-1 - answered[:,::-1].argmax(axis=1)).astype(float),
+    },index=pd.Index(index,name='probe'))
+
+def boxplot_stats(hists,whis=1.5):
+    """Boxplot stats of every probe for ax.bxp, same as
+    ax.boxplot would get from the raw responses."""
+    stats = describe(hists,range(len(hists)))
+    iqr = stats['75%'] - stats['25%']
+    bxpstats = []
+    for i, row in stats.iterrows():
+        answered = LEVELS[hists[i]>0]
+        lo_limit = row['25%'] - whis*iqr[i]
+        hi_limit = row['75%'] + whis*iqr[i]
+        # whiskers go to the furthest responses still within the limits
+        whislo = answered[answered>=lo_limit].min(initial=row['25%'])
+        whishi = answered[answered<=hi_limit].max(initial=row['75%'])
+        is_flier = (LEVELS<whislo) | (LEVELS>whishi)
+        bxpstats.append(dict(mean=row['mean'],med=row['50%'],
+            q1=row['25%'],q3=row['75%'],whislo=whislo,whishi=whishi,
+            fliers=np.repeat(LEVELS[is_flier],hists[i][is_flier])))
+    return bxpstats
+
+###########################################
+
+
 ###########  load data  ###########
 
-df = pd.read_csv(DATA_FNAME)
+# only the DLQ/MUSK columns are needed
+probe_cols = [ col for col in dataset.columns() if 'DLQ' in col or 'MUSK' in col ]
+df = dataset.load_data(columns=['dream_report']+probe_cols)
 
 # get rid of dreams without recall
 df.dropna(subset=['dream_report'],axis=0,inplace=True)
 
-# extract data for plot, which is only the DLQ/MUSK columns
-probe_cols = [ col for col in df.columns if 'DLQ' in col or 'MUSK' in col ]
-plot_data_all = df[probe_cols].values
-plot_data_lim = df.loc[df['DLQ_01']>0,probe_cols].values
+# all dreams, and just the dreams with nonzero lucidity
+hists_all = dataset.histograms(df,probe_cols)
+hists_lim = dataset.histograms(df[df['DLQ_01'].fillna(0)>0],probe_cols)
 
 ###########################################
 
@@ -74,10 +136,10 @@ fig, axes = plt.subplots(1,2,figsize=(FIGURE_WIDTH,height))
 
 # loop over two datasets
 # (first is all dreams, second is just nonzero-lucidity dreams)
-for i, (ax,data) in enumerate(zip(axes,[plot_data_all,plot_data_lim])):
+for i, (ax,hists) in enumerate(zip(axes,[hists_all,hists_lim])):
    
     # boxplot
-    ax.boxplot(data,**BOX_ARGS)
+    ax.bxp(boxplot_stats(hists),**BOX_ARGS)
 
     # aesthetics
     ax.set_xticks(range(5))
@@ -106,27 +168,12 @@ plt.close()
 
 #######  descriptives table/dataframe  #######
 
-# go from wide to long format
-df_melt = df.melt(value_vars=probe_cols,
-                  id_vars=['participant_id'],
-                  var_name='probe',
-                  value_name='likert')
-
 # get mean and quartiles (includes median)
-summ_df = df_melt.groupby('probe')['likert'].describe()
-
-# convert to categorical so 0s will show up in crosstab
-df_melt['likert'] = pd.Categorical(df_melt['likert'],
-                                   categories=range(5),
-                                   ordered=True)
-
-# make the contingency table
-cont_df = pd.crosstab(df_melt['probe'],
-                      df_melt['likert'],
-                      dropna=False)
+summ_df = describe(hists_all,probe_cols)
 
-# drop extra layer for column index
-cont_df.columns = [ f'freq_likert-{x}' for x in cont_df.columns ]
+# the contingency table is just the histograms
+cont_df = pd.DataFrame(hists_all,index=summ_df.index,
+    columns=[ f'freq_likert-{x}' for x in range(N_LEVELS) ])
 
 # combine both dataframes
 descr_df = summ_df.join(cont_df)
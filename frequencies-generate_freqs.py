@@ -4,36 +4,47 @@ lucidity level (DLQ1) selected for each participant.
 
 Exports csv table that gets imported
 by all the other <frequencies-*> scripts.
+
+With --update, only recount the participants that the last
+xls2csv.py run changed and swap their rows in the existing table.
+
+The counts come from the Likert count tensor
+saved with the dataset (see dataset.py and frequencies.py)
 """
 from os import path
 from json import load
+import argparse
 import pandas as pd
 
+import dataset
+import frequencies
+
 ## parameters
 
 with open('./config.json') as f:
     p = load(f)
-    DATA_DIR  = path.expanduser(p['data_directory'])
     DERIV_DIR = path.expanduser(p['derivatives_directory'])
 
-IMPORT_FNAME = path.join(DATA_DIR,'data.csv')
 EXPORT_FNAME = path.join(DERIV_DIR,'ld_freqs.csv')
 
-##
+parser = argparse.ArgumentParser()
+parser.add_argument('--update',action='store_true',
+    help='only recount participants changed by the last xls2csv.py run')
+args = parser.parse_args()
 
-# load data
-df_in = pd.read_csv(IMPORT_FNAME)
+##
 
-# get lucidity/DLQ1 frequencies grouped by participant
-df_out = df_in.groupby('participant_id')['DLQ_01'
-    ].value_counts(dropna=False
-    ).unstack(fill_value=0)
+# get lucidity/DLQ1 frequencies of each participant
+participants = dataset.updated_participants() if args.update else None
+df_out = frequencies.lucidity_counts(dataset.load_counts(),participants)
 
-# make column names readable
-df_out.columns = [ 'No recall' if pd.isna(x) else f'DLQ01_resp-{x:.0f}'
-    for x in df_out.columns ]
+if args.update:
+    # replace (or add) just the updated participants' rows
+    df_old = pd.read_csv(EXPORT_FNAME,index_col='participant_id')
+    df_out = df_out.reindex(columns=df_old.columns,fill_value=0)
+    df_out = pd.concat([df_old.drop(df_out.index,errors='ignore'),df_out]).sort_index()
 
 assert df_out.shape[1] == 6, 'Not all resp options present'
 
 # save
-df_out.to_csv(EXPORT_FNAME,index=True)
\ No newline at end of file
+df_out.to_csv(EXPORT_FNAME,index=True)
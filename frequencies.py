@@ -0,0 +1,364 @@
+"""
+The lucidity frequency analyses, as functions that take and
+return DataFrames (see the frequencies-*.py scripts for what
+each one is for). The scripts are thin wrappers that load and
+save the csv files in between, while pipeline.py --in-process
+chains these functions in memory.
+
+The lucidity cutoffs and evaluations are set in config.json.
+A cutoff is the lowest DLQ1 response that counts as a lucid
+dream. An evaluation turns each participant's number of lucid
+dreams into a rate, dividing by their nights with recall
+("dreams") or all their nights ("nights"), or just
+checking if they had any ("any").
+
+Confidence intervals of the mean rates come from a participant
+bootstrap. All the resampled participant sets are drawn as one
+index matrix, turned into a (bootstrap x participant) matrix of
+how often each participant got drawn, so every eval x cutoff
+mean of every bootstrap is one matrix product with the rates.
+Both percentile and BCa (bias corrected and accelerated, with
+a jackknife over participants) 95% intervals are reported.
+
+The repeated measures ANOVA across evaluations and cutoffs runs
+on the same (participant, eval, cutoff) array (see anova.py),
+with a permutation pvalue for their interaction.
+
+Plotting functions import matplotlib only when called, so the
+analyses can be imported without it.
+"""
+from json import load
+
+import numpy as np
+import pandas as pd
+
+import anova
+
+
+with open('./config.json') as f:
+    p = load(f)
+    CUTOFFS = p['lucidity_cutoffs']
+    EVALS = p['lucidity_evaluations']
+    N_BOOTSTRAPS = p['n_rate_bootstraps']
+    N_PERMUTATIONS = p['n_anova_permutations']
+
+DLQ_COLS = [ f'DLQ01_resp-{i}' for i in range(5) ]
+RESP_COLS = [ 'No recall' ] + DLQ_COLS
+
+DENOMINATORS = ['dreams','nights','any']
+
+SEED = 5 # for reproducible bootstraps
+
+# choose params to make 95% confidence intervals
+CI_LO = .025
+CI_HI = .975
+
+MARKERS = dict(ld_per_dream='s',ld_per_night='o',binary_ld='^')
+OFFSETS = dict(ld_per_dream=.07,ld_per_night=-.07) # so errorbars don't overlap
+LABELS = dict(ld_per_night='LDs per night',
+              ld_per_dream='LDs per night with recall',
+              binary_ld='Participants with >0 LDs')
+
+
+#########  counting  #########
+
+def lucidity_counts(counts,participants=None):
+    """Number of nights with each DLQ1 response (or without
+    recall) for every participant (or just the ones given),
+    from the Likert count tensor (see dataset.py)."""
+    freqs = counts.item('DLQ_01',participants)
+    # make column names readable
+    freqs.columns = [ 'No recall' if x == 'NA' else f'DLQ01_resp-{x}'
+        for x in freqs.columns ]
+    return freqs
+
+def cumulative_counts(freqs):
+    """Cumulative sum across response options, for stacked bars."""
+    cumsum_cols = np.roll(freqs.columns.sort_values(ascending=False),-1).tolist()
+    return freqs[cumsum_cols].cumsum(axis=1)
+
+def total_counts(freqs):
+    """Number of nights with each DLQ1 response, over all participants."""
+    return freqs[DLQ_COLS].sum(axis=0).values
+
+##############################
+
+
+#########  cutoffs  #########
+
+def cutoff_label(c):
+    return f'cutoff_{c}'
+
+def cutoff_rate_grid(freqs,evals=EVALS,cutoffs=CUTOFFS):
+    """(participant, eval, cutoff) array of lucid dream rates,
+    all computed at once from the DLQ1 counts."""
+    assert all( 0 < c < len(DLQ_COLS) for c in cutoffs ), 'Cutoffs have to be nonzero DLQ1 responses'
+    counts = freqs[DLQ_COLS].to_numpy()
+    # nights at or above every lucidity level, so each
+    # cutoff's lucid dreams are a single lookup
+    n_atleast = counts[:,::-1].cumsum(axis=1)[:,::-1]
+    n_lucids = n_atleast[:,cutoffs].astype(float) # participant x cutoff
+
+    assert set(evals.values()) <= set(DENOMINATORS), f'Evaluations have to be one of {DENOMINATORS}'
+    denominators = dict(dreams=counts.sum(axis=1),
+        nights=freqs[RESP_COLS].to_numpy().sum(axis=1),
+        any=np.ones(len(counts)))
+    # participant x eval x cutoff
+    denoms = np.column_stack([ denominators[d] for d in evals.values() ])[:,:,None]
+    is_any = np.array([ d == 'any' for d in evals.values() ])[None,:,None]
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        rates = np.where(is_any,n_lucids[:,None,:] > 0,n_lucids[:,None,:] / denoms)
+    # no nights (or dreams) to count from means no lucid dreams
+    return np.nan_to_num(rates,nan=0.)
+
+def cutoff_rates(freqs,evals=EVALS,cutoffs=CUTOFFS):
+    """Every participant's lucid dream rate for each evaluation
+    method and lucidity cutoff, in long format."""
+    rates = cutoff_rate_grid(freqs,evals,cutoffs)
+    index = pd.MultiIndex.from_product([freqs.index,list(evals),[ cutoff_label(c) for c in cutoffs ]],
+        names=['participant_id','eval','cutoff'])
+    return pd.Series(rates.ravel(),index=index,name='ld_rate')
+
+def bootstrap_means(rates,n_bootstraps=N_BOOTSTRAPS,seed=SEED):
+    """(bootstrap, eval, cutoff) array of mean rates, each
+    over participants resampled with replacement."""
+    rng = np.random.default_rng(seed)
+    n_pps = len(rates)
+    draws = rng.integers(n_pps,size=(n_bootstraps,n_pps))
+    # how many times each participant was drawn in each bootstrap
+    rows = np.repeat(np.arange(n_bootstraps),n_pps)
+    weights = np.bincount(rows*n_pps + draws.ravel(),
+        minlength=n_bootstraps*n_pps).reshape(n_bootstraps,n_pps)
+    means = weights @ rates.reshape(n_pps,-1) / n_pps
+    return means.reshape((n_bootstraps,)+rates.shape[1:])
+
+def sorted_quantiles(sorted_values,q):
+    """Quantiles (interpolated like numpy) along the first
+    axis of sorted values, with a different q for every cell."""
+    position = q * (len(sorted_values)-1)
+    lo = np.floor(position).astype(int)
+    hi = np.ceil(position).astype(int)
+    lo_values = np.take_along_axis(sorted_values,lo,axis=0)
+    hi_values = np.take_along_axis(sorted_values,hi,axis=0)
+    return lo_values + (position-lo) * (hi_values-lo_values)
+
+def bootstrap_cis(rates,boot_means):
+    """Percentile and BCa confidence interval bounds of the
+    mean rates, each as an (eval, cutoff) array."""
+    from scipy.stats import norm
+    n_pps = len(rates)
+    mean = rates.mean(axis=0)
+    boot_means = np.sort(boot_means,axis=0)
+    alphas = np.array([CI_LO,CI_HI]).reshape(2,1,1)
+    percentile = sorted_quantiles(boot_means,np.broadcast_to(alphas,(2,)+mean.shape))
+
+    # bias correction, from how many bootstrap means fall below
+    # the actual one (counting ties as half, rates are discrete)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        below = ( (boot_means < mean).mean(axis=0) + (boot_means <= mean).mean(axis=0) ) / 2
+        z0 = norm.ppf(below)
+        # acceleration, from the jackknife means leaving out each participant
+        jackknife = (rates.sum(axis=0) - rates) / (n_pps-1)
+        deviations = jackknife.mean(axis=0) - jackknife
+        accel = (deviations**3).sum(axis=0) / (6 * ((deviations**2).sum(axis=0))**1.5)
+        z = norm.ppf(alphas)
+        bca_alphas = norm.cdf(z0 + (z0+z) / (1 - accel*(z0+z)))
+    # cells where all participants (or bootstraps) agree
+    # can't be corrected, and there all the bounds are the mean anyway
+    valid = np.isfinite(bca_alphas)
+    bca = sorted_quantiles(boot_means,np.where(valid,bca_alphas,.5))
+    bca = np.where(valid,bca,percentile)
+    return percentile, bca
+
+def cutoff_stats(freqs,evals=EVALS,cutoffs=CUTOFFS,
+        n_bootstraps=N_BOOTSTRAPS,n_permutations=N_PERMUTATIONS):
+    """Mean/sem and bootstrapped confidence intervals of the lucid
+    dream rates at each evaluation and cutoff, and a repeated
+    measures ANOVA across them (without binary evaluations)."""
+    rates = cutoff_rate_grid(freqs,evals,cutoffs)
+    percentile, bca = bootstrap_cis(rates,bootstrap_means(rates,n_bootstraps))
+    index = pd.MultiIndex.from_product([list(evals),[ cutoff_label(c) for c in cutoffs ]],
+        names=['eval','cutoff'])
+    avgs = pd.DataFrame(dict(
+            mean=rates.mean(axis=0).ravel(),
+            sem=(rates.std(axis=0,ddof=1) / np.sqrt(len(rates))).ravel(),
+            pct_cilo=percentile[0].ravel(),pct_cihi=percentile[1].ravel(),
+            bca_cilo=bca[0].ravel(),bca_cihi=bca[1].ravel()),
+        index=index).sort_index(level='eval',sort_remaining=False)
+
+    # replace sem for the binary case bc it's meaningless
+    binary_evals = [ ev for ev, d in evals.items() if d == 'any' ]
+    avgs.loc[binary_evals,'sem'] = pd.NA
+
+    rate_evals = [ i for i, ev in enumerate(evals) if ev not in binary_evals ]
+    aov = anova.rm_anova(rates[:,rate_evals,:],factors=('eval','cutoff'),
+        n_permutations=n_permutations,seed=SEED)
+    return avgs, aov
+
+##############################
+
+
+#########  plots  #########
+
+def plot_subjects(cumsum_df,fname,figsize=(5,3)):
+    """A single bar per participant, stacking the
+    cumulative counts of each lucidity level."""
+    import pyplotparams as myplt
+    import matplotlib.pyplot as plt
+
+    cumsum_cols = cumsum_df.columns.tolist()
+    fig, ax = plt.subplots(figsize=figsize)
+
+    xvals = range(cumsum_df.index.size)
+    for col, series in cumsum_df.iteritems():
+        color = myplt.NORECALL_COLOR if col == 'No recall' else myplt.dlqcolor(int(col[-1]))
+        zorder = cumsum_cols[::-1].index(col)
+        ax.barh(y=xvals,width=series.values,zorder=zorder,color=color,
+            edgecolor='k',linewidth=0)
+        if col == 'DLQ01_resp-0':
+            ax.barh(y=xvals,width=series.values,zorder=10,color='none',
+                edgecolor='k',linewidth=1)
+
+
+    ax.set_xticks(range(cumsum_df.max().max()+1))
+    ax.set_yticks(range(min(xvals),max(xvals)+1))
+    ax.set_yticklabels(np.arange(cumsum_df.index.nunique())+1)
+    ax.set_xlabel('Number of nights')
+    ax.set_ylabel('Participant')
+    ax.invert_yaxis()
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    legend_patches = [myplt.norecall_patch] + myplt.dlqpatches
+    leg = ax.legend(handles=legend_patches,loc='center left',
+                    title='       I was aware\nthat I was dreaming.\n          (lucidity)',
+                    frameon=True,bbox_to_anchor=(1.,.5),
+                    title_fontsize=10,fontsize=8)
+    plt.setp(leg.get_title(),fontweight='bold')
+
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+def plot_totals(freqs,fname,figsize=(1.75,3),tick_fontsize=6,xtick_fontsize_inset=6):
+    """Histogram of all DLQ1 responses, with an inset
+    grouping all the nonzero lucidity responses."""
+    import pyplotparams as myplt
+    import matplotlib.pyplot as plt
+    from matplotlib import ticker as mticker
+
+    nonlucid = freqs[0]
+    nonzero_lucid = sum(freqs[1:])
+
+    ##########  draw all frequencies  ###########
+
+    fig, ax = plt.subplots(figsize=figsize)
+
+    colors = [ myplt.dlqcolor(i) for i in range(5) ]
+    xvals = range(5)
+    ax.bar(xvals,freqs,color=colors,edgecolor='k',width=1,linewidth=.5)
+
+    ax.set_xlim(-.75,4.75)
+    ax.set_ylim(0,max(freqs)+1)
+    ax.yaxis.set_major_locator(mticker.MultipleLocator(20))
+    ax.yaxis.set_minor_locator(mticker.MultipleLocator(5))
+    ax.set_xticks(range(5))
+    ax.set_xticklabels(list(myplt.DLQ_STRINGS.values()),rotation=25,
+                       ha='right',fontsize=tick_fontsize)
+    ax.set_ylabel('Number of nights')
+    ax.set_xlabel('Lucidity')
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    ##########  draw just nonlucid vs nonzero_lucid frequencies  ###########
+
+    ax2 = ax.inset_axes([0.6, 0.6, 0.4, 0.5])
+
+    colors = [ myplt.dlqcolor(0), 'gray' ]
+    xvals = range(2)
+    yvals = [nonlucid,nonzero_lucid]
+    ax2.bar(xvals,yvals,color=colors,edgecolor='k',width=1,linewidth=.5)
+
+    ax2.set_xlim(-.75,1.75)
+    ax2.set_ylim(0,max(yvals)+1)
+    ax2.yaxis.set_major_locator(mticker.MultipleLocator(20))
+    ax2.yaxis.set_minor_locator(mticker.MultipleLocator(5))
+    ax2.set_yticklabels([])
+    ax2.set_xticks([])
+    first_ticklabel = list(myplt.DLQ_STRINGS.values())[0]
+    second_ticklabel = 'Nonzero lucidity'
+    xticklabels = [first_ticklabel,second_ticklabel]
+    for i, txt in enumerate(xticklabels):
+        ax2.text(i,0,f'  {txt}',rotation=90,ha='center',va='bottom',fontsize=xtick_fontsize_inset)
+    ax2.spines['top'].set_visible(False)
+    ax2.spines['right'].set_visible(False)
+
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+def plot_cutoffs(avgs,fname,figsize=(3,3),evals=EVALS,cutoffs=CUTOFFS):
+    """Lucid dream rates of every evaluation across cutoffs."""
+    import pyplotparams as myplt
+    import matplotlib.pyplot as plt
+    from matplotlib import lines as mlines
+    from matplotlib import ticker as mticker
+
+    fig, ax = plt.subplots(figsize=figsize)
+
+    # draw lines and points separately to have diff colored points
+    for ev, subdf in avgs.groupby('eval'):
+
+        xvals = np.arange(len(cutoffs)) + OFFSETS.get(ev,0)
+        yvals = subdf['mean']
+
+        if evals[ev] != 'any':
+            yerr  = subdf['sem']
+        else:
+            # no sem for the binary rates, so use their bootstrapped CI
+            yerr = abs( subdf[['bca_cilo','bca_cihi']].values.T - yvals.values )
+        ax.errorbar(xvals,yvals,yerr,
+            color='k',linestyle='-',linewidth=.5,zorder=1)
+        ax.scatter(xvals,yvals,
+            color=[ myplt.dlqcolor(c) for c in cutoffs ],
+            marker=MARKERS.get(ev,'o'),edgecolors='w',
+            s=70,zorder=2,linewidths=1)
+
+    # handle the xaxis
+    ax.set_xticks(range(len(cutoffs)))
+    xticklabels = [ myplt.DLQ_STRINGS[c] for c in cutoffs ]
+    xticklabels = [ x if x == 'Very much' else f'>= {x}'
+                    for x in xticklabels ]
+    ax.set_xticklabels(xticklabels,rotation=25,ha='right')
+    ax.set_xlabel('Lucidity cutoff')
+
+    # handle yaxes
+    ax.yaxis.set_major_locator(mticker.MultipleLocator(.5))
+    ax.yaxis.set_minor_locator(mticker.MultipleLocator(.1))
+    ax.set_xlim(-0.5,len(cutoffs)-.5)
+    ax.set_ylim(0,1)
+    ax.set_ylabel('Lucid dream frequency')
+    # ax.set_yticklabels(major_yticklabels)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+
+    ax.grid(True,axis='y',which='both',
+            linestyle='--',linewidth=.25,color='k',alpha=1)
+
+    # legend for markers
+    legend_patches = [ mlines.Line2D([],[],
+                        label=LABELS.get(key,key),marker=MARKERS.get(key,'o'),
+                        color='gray',linestyle='none')
+                    for key in evals ]
+    leg = ax.legend(handles=legend_patches,loc='upper right',
+              title='Evaluation',frameon=True,framealpha=1,edgecolor='k',
+              handletextpad=-0.2, # space between legend marker and label
+              labelspacing=0.2, # like rowspacing, vertical space between the legend entries
+              title_fontsize=10,fontsize=8)
+
+    plt.tight_layout()
+    plt.savefig(fname)
+    plt.close()
+
+##############################
@@ -14,64 +14,118 @@ responses, and DLQ1 response, and export 2 text files:
     2. one that groups all open questions by lucidity rating
         Sp DLQ1 > OpenQs > response
         <open_questions-by_response.txt>
+
+The nights get sorted once (by DLQ1 and night), and then each
+file is streamed out line by line in a single pass, so the text
+is never held in memory as a whole. With --gzip the files get
+compressed as they're written (.txt.gz), and with --jsonl each
+response is written as one JSON record instead, in the same
+order (open_questions-by_*.jsonl).
 """
 from os import path
-from json import load
-from collections import OrderedDict
+from json import load, dumps
+import gzip
+import argparse
+
+import numpy as np
 
-import pandas as pd
+import dataset
 
 
 ######  parameter setup  ######
 
 with open('./config.json') as f:
     p = load(f)
-    DATA_DIR  = path.expanduser(p['data_directory'])
     DERIV_DIR = path.expanduser(p['derivatives_directory'])
 
 COLS2KEEP = ['night_id','DLQ_01','dream_report',
     'INTERR_1','INTERR_2','INTERR_3','INTERR_4']
 
-IMPORT_FNAME = path.join(DATA_DIR,'data.csv')
-
-ID_COLS = ['night_id','DLQ_01']
 VAL_COLS = [ f'INTERR_{x}' for x in range(5) ]
 
 SORT_ORDERS = dict(by_response=['DLQ_01','probe'],
                    by_probe=['probe','DLQ_01'])
 
-################################
-
-
-df = pd.read_csv(IMPORT_FNAME,usecols=COLS2KEEP)
+BUFFER_SIZE = 2**20 # bytes held before each write to disk
 
-# drop nights without dream recall
-df.dropna(subset=['dream_report'],axis=0,inplace=True)
+parser = argparse.ArgumentParser()
+parser.add_argument('--jsonl',action='store_true',
+    help='write one JSON record per response instead of the indented text')
+parser.add_argument('--gzip',action='store_true',
+    help='gzip the exported files')
 
-df['DLQ_01'] = df['DLQ_01'].astype(int)
-
-df.rename(columns={'dream_report':'INTERR_0'},inplace=True)
-
-melted_df = df.melt(id_vars=ID_COLS,value_vars=VAL_COLS,
-                    var_name='probe',value_name='response')
-
-for key, sort_order in SORT_ORDERS.items():
-    top_col, bot_col = sort_order
-    text = ''
-    
-    for top_id, top_df in melted_df.groupby(top_col):
-        text += f'{top_id}\n'
-
-        for bot_id, bot_df in top_df.groupby(bot_col):
-            text += f'\t{bot_id}\n'
+################################
 
-            for night_id, night_df in bot_df.groupby('night_id'):
-                assert len(night_df) == 1
-                response = night_df['response'].values[0]
-                text += f'\t\t{night_id} : {response}\n'
 
-    export_fname = path.join(DERIV_DIR,f'open_questions-{key}.txt')
-    with open(export_fname,'w') as outfile:
-        outfile.write(text)
+def groups(top_col,levels,starts):
+    """(top, bottom, probe, start, stop) of every group of nights
+    in the order they get written, start/stop being the rows of
+    the group in the sorted nights. Every probe has all nights,
+    so each DLQ1 level is the same rows for any probe."""
+    bounds = list(zip(levels,starts[:-1],starts[1:]))
+    if top_col == 'probe':
+        for probe in VAL_COLS:
+            for level, start, stop in bounds:
+                yield probe, level, probe, start, stop
+    else:
+        for level, start, stop in bounds:
+            for probe in VAL_COLS:
+                yield level, probe, probe, start, stop
+
+def write_text(outfile,groups,night_ids,responses):
+    previous_top = None
+    for top, bottom, probe, start, stop in groups:
+        if top != previous_top:
+            outfile.write(f'{top}\n')
+            previous_top = top
+        outfile.write(f'\t{bottom}\n')
+        # missing responses are written the way pandas prints them
+        outfile.writelines( f'\t\t{night_id} : {"nan" if response is None else response}\n'
+            for night_id, response in zip(night_ids[start:stop],responses[probe][start:stop]) )
+
+def write_jsonl(outfile,groups,night_ids,responses,sort_order):
+    for top, bottom, probe, start, stop in groups:
+        keys = dict(zip(sort_order,(top,bottom)))
+        outfile.writelines( dumps(dict(keys,night_id=night_id,response=response)) + '\n'
+            for night_id, response in zip(night_ids[start:stop],responses[probe][start:stop]) )
+
+def open_export(key,args):
+    extension = '.jsonl' if args.jsonl else '.txt'
+    export_fname = path.join(DERIV_DIR,f'open_questions-{key}{extension}')
+    if args.gzip:
+        return gzip.open(export_fname+'.gz','wt')
+    return open(export_fname,'w',buffering=BUFFER_SIZE)
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    df = dataset.load_data(columns=COLS2KEEP)
+
+    # drop nights without dream recall
+    df.dropna(subset=['dream_report'],axis=0,inplace=True)
+
+    df.rename(columns={'dream_report':'INTERR_0'},inplace=True)
+
+    # sort once, by DLQ1 and then night (as text, like they're listed)
+    df['night_id'] = df['night_id'].astype(str)
+    df['DLQ_01'] = df['DLQ_01'].astype(int)
+    df.sort_values(['DLQ_01','night_id'],kind='mergesort',inplace=True)
+
+    night_ids = df['night_id'].to_numpy()
+    responses = { col: df[col].astype(object).where(df[col].notna(),None).to_numpy()
+        for col in VAL_COLS }
+    levels, starts = np.unique(df['DLQ_01'].to_numpy(),return_index=True)
+    starts = np.append(starts,len(df))
+    levels = levels.tolist() # plain ints for writing
+
+    for key, sort_order in SORT_ORDERS.items():
+        with open_export(key,args) as outfile:
+            key_groups = groups(sort_order[0],levels,starts)
+            if args.jsonl:
+                write_jsonl(outfile,key_groups,night_ids,responses,sort_order)
+            else:
+                write_text(outfile,key_groups,night_ids,responses)
 
 ################################
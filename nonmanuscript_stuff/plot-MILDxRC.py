@@ -8,10 +8,11 @@ included in the paper in any way.
 from os import path
 import pandas as pd
 
-import matplotlib; matplotlib.use('Qt5Agg')
-import matplotlib.pyplot as plt; plt.ion()
-
 import pyplotparams as myplt
+import matplotlib
+if not myplt.HEADLESS:
+    matplotlib.use('Qt5Agg')
+import matplotlib.pyplot as plt; myplt.ion()
 
 datadir = path.expanduser('~/IDrive-Sync/proj/phenol/data')
 resdir  = path.expanduser('~/IDrive-Sync/proj/phenol/results')
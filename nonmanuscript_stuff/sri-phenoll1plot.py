@@ -4,7 +4,6 @@ Focus on morning mood correlations.
 There is more manual here than I'm usually comfortable with
 but I'm sure this is a one-time use plot so whateva.
 """
-import json
 
 import numpy as np
 import pandas as pd
@@ -16,6 +15,7 @@ import matplotlib.patheffects as mpatheffects
 import seaborn as sea
 
 import pyplotparams as myplt
+import dataset
 
 from matplotlib import rcParams
 rcParams['savefig.dpi'] = 300
@@ -27,30 +27,16 @@ rcParams['axes.spines.right'] = False
 
 EXPORT_FNAME = '../results/sri-phenoll1_plot.png'
 
-# load parameters from configuration file
-with open('./config.json','r') as f:
-    p = json.load(f)
-    pos_probes = p['PANAS_positive_probes']
-    neg_probes = p['PANAS_negative_probes']
-    control_probes = p['DLQ_control_probes']
-
 data_fname = '../data/data.tsv'
 resample_fname = '../results/correlations-data.tsv'
 stats_fname = '../results/correlations-stats.tsv'
 
-datadf = pd.read_csv(data_fname,sep='\t')
+# composite scales (PANAS_pos etc) get scored the
+# SAME WAY as in the correlation scripts, by dataset.py
+datadf = dataset.add_composites(pd.read_csv(data_fname,sep='\t'))
 rsmpdf = pd.read_csv(resample_fname,sep='\t',index_col='probe')
 statdf = pd.read_csv(stats_fname,sep='\t',index_col='probe')
 
-# manipulate data SAME WAY was done in the correlation script
-# generate columns that require manipulations of the raw data
-panas_pos_cols = [ f'PANAS_{x:02d}' for x in pos_probes ]
-panas_neg_cols = [ f'PANAS_{x:02d}' for x in neg_probes ]
-control_cols   = [ f'DLQ_{x:02d}' for x in control_probes ]
-datadf['PANAS_pos']     = datadf[panas_pos_cols].sum(axis=1)
-datadf['PANAS_neg']     = datadf[panas_neg_cols].sum(axis=1)
-datadf['dream_control'] = datadf[control_cols].mean(axis=1)
-
 
 #######  raw data plots with regression lines  #######
 
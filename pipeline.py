@@ -0,0 +1,414 @@
+"""
+Run the whole analysis (the sequence of scripts in the README),
+skipping every stage whose outputs are already up to date.
+
+Each stage declares the files it reads and writes and the
+config.json keys it uses. A stage gets rerun when the hash of
+its code (the script and the local modules it imports), its
+input files or its config keys changed since it last ran,
+or when one of its outputs is missing or was changed since.
+The hashes are kept in <derivatives_dir>/.pipeline_hashes.json
+
+Config keys that only change how results are written out
+(float_formatting) are listed separately as render keys.
+If nothing but those changed, a stage with a cheaper way to
+just rewrite its outputs (its rerender args) does only that.
+So a new float_formatting re-exports correlates.csv from the
+saved resamples (correlations-resample.py --resume) instead of
+running all the resamples again, and any later stage only
+reruns if that changed its input files.
+
+Stages only wait for the stages that write their inputs (the
+dependencies are worked out from the declared files), so with
+--jobs N the independent branches (frequencies, regression,
+correlations, DLQ descriptives and open questions) run at the
+same time in up to N processes. The wall time of every stage
+is saved to <derivatives_dir>/pipeline-timings.csv
+
+With --in-process everything runs in this one process instead.
+The frequencies and correlations stages are chained in memory
+through frequencies.py and correlations.py, so intermediate
+tables (ld_freqs.csv, correlates.csv, correlates_withz.csv) are
+never written or rounded to float_formatting in between, and
+only final outputs get saved. This always runs every stage.
+
+Stages run headless (PHENOLL_HEADLESS=1, see pyplotparams.py)
+unless PHENOLL_HEADLESS is already set, so nothing opens a plot
+window or waits on an interactive backend.
+
+    python pipeline.py                  # run whatever is out of date
+    python pipeline.py --dry-run        # list what would run
+    python pipeline.py --jobs 4         # run independent stages in parallel
+    python pipeline.py --force correlations-plot   # rerun some stages anyway
+    python pipeline.py --in-process     # run it all in memory
+"""
+from os import path
+from json import load, dump
+import os
+import ast
+import csv
+import sys
+import time
+import hashlib
+import runpy
+import argparse
+import subprocess
+
+
+#######  parameter setup  #######
+
+with open('./config.json') as f:
+    p = load(f)
+    DATA_DIR  = path.expanduser(p['data_directory'])
+    DERIV_DIR = path.expanduser(p['derivatives_directory'])
+    FLOAT_FMT = p['float_formatting']
+    N_RESAMPLES = p['n_correlation_resamples']
+    CONFIG = p
+
+HASHES_FNAME = path.join(DERIV_DIR,'.pipeline_hashes.json')
+TIMINGS_FNAME = path.join(DERIV_DIR,'pipeline-timings.csv')
+
+POLL_INTERVAL = .05 # seconds between checks on running stages
+
+CODE_DIR = path.dirname(path.abspath(__file__))
+
+data  = lambda fn: path.join(DATA_DIR,fn)
+deriv = lambda fn: path.join(DERIV_DIR,fn)
+
+# the composite scales, and the probe lists they can point to
+SCALE_KEYS = ['composite_scales','PANAS_positive_probes','PANAS_negative_probes','DLQ_control_probes']
+
+# in the same order as the README
+STAGES = [
+    dict(script='dataset.py',
+        inputs=[data('data.csv')],
+        outputs=[data('data.parquet'),data('likert_counts.npz')],
+        config=SCALE_KEYS),
+    dict(script='dlq_descriptives.py',
+        inputs=[data('data.parquet')],
+        outputs=[deriv('dlq.eps'),deriv('dlq.csv')],
+        config=['DLQ_probes'],
+        render=['float_formatting']),
+    dict(script='frequencies-generate_freqs.py',
+        inputs=[data('likert_counts.npz')],
+        outputs=[deriv('ld_freqs.csv')]),
+    dict(script='frequencies-indiv_subjs.py',
+        inputs=[deriv('ld_freqs.csv')],
+        outputs=[deriv('ld_freqs-subjs.csv'),deriv('ld_freqs-subjs.svg')]),
+    dict(script='frequencies-agg.py',
+        inputs=[deriv('ld_freqs.csv')],
+        outputs=[deriv('ld_freqs.svg')]),
+    dict(script='frequencies-cutoffs.py',
+        inputs=[deriv('ld_freqs.csv')],
+        outputs=[deriv('ld_freqs-cutoffs_data.csv'),deriv('ld_freqs-cutoffs_stats.csv'),
+                 deriv('ld_freqs-cutoffs_plot.svg')],
+        config=['lucidity_cutoffs','lucidity_evaluations','n_rate_bootstraps','n_anova_permutations'],
+        render=['float_formatting']),
+    dict(script='regression-model.R',
+        inputs=[data('data.csv')],
+        outputs=[deriv('adherence-stats.csv'),deriv('adherence-stats.txt'),
+                 deriv('adherence-probs.csv')]),
+    dict(script='regression-plot_dv.py',
+        inputs=[deriv('adherence-probs.csv')],
+        outputs=[deriv('adherence-probs.svg')]),
+    dict(script='regression-plot_iv.py',
+        inputs=[data('data.parquet')],
+        outputs=[deriv('adherence.svg')]),
+    dict(script='correlations-resample.py',
+        inputs=[data('data.parquet')],
+        outputs=[deriv('correlates.csv')],
+        config=['n_correlation_resamples'],
+        render=['float_formatting'],
+        rerender=['--resume']),
+    dict(script='correlations-zscore.py',
+        # the exact taus are optional, but get used if they're
+        # there (and from the same data)
+        inputs=[data('data.parquet'),deriv('correlates.csv'),deriv('correlates-exact.csv')],
+        outputs=[deriv('correlates_withz.csv'),deriv('correlates-stats.csv')],
+        render=['float_formatting']),
+    dict(script='correlations-plot.py',
+        inputs=[data('data.parquet'),deriv('correlates_withz.csv'),deriv('correlates-stats.csv')],
+        outputs=[deriv('correlates-plot.svg'),deriv('correlates-plot_zs.svg')]),
+    dict(script='group_openquestions.py',
+        inputs=[data('data.parquet')],
+        outputs=[deriv('open_questions-by_probe.txt'),deriv('open_questions-by_response.txt')]),
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('stages',nargs='*',
+    help='stages (script names, without extension) to rerun even if up to date')
+parser.add_argument('--force',action='store_true',
+    help='rerun the given stages, or all of them if none are given')
+parser.add_argument('-n','--dry-run',action='store_true',
+    help='only list which stages would run')
+parser.add_argument('-j','--jobs',type=int,default=1,
+    help='number of stages to run at the same time (or resampling processes with --in-process)')
+parser.add_argument('--in-process',action='store_true',
+    help='run everything in this process, passing intermediate tables in memory')
+
+##################################
+
+
+#######  hashing  #######
+
+def stage_name(stage):
+    return path.splitext(stage['script'])[0]
+
+def file_hash(fname):
+    """sha256 of a file's contents, or None if it doesn't exist."""
+    if not path.isfile(fname):
+        return None
+    h = hashlib.sha256()
+    with open(fname,'rb') as f:
+        for chunk in iter(lambda: f.read(2**20),b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def local_modules(script):
+    """The script plus every module from this folder that it
+    (or those modules) import, so code changes are caught too."""
+    found = [script]
+    for fname in found:
+        if not fname.endswith('.py'):
+            continue
+        with open(path.join(CODE_DIR,fname)) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node,ast.Import):
+                names = [ alias.name for alias in node.names ]
+            elif isinstance(node,ast.ImportFrom) and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_fname = name.split('.')[0] + '.py'
+                if module_fname not in found and path.isfile(path.join(CODE_DIR,module_fname)):
+                    found.append(module_fname)
+    return sorted(found)
+
+def config_hash(keys):
+    values = { key: CONFIG.get(key) for key in keys }
+    return hashlib.sha256(repr(sorted(values.items())).encode()).hexdigest()
+
+def stage_hashes(stage):
+    """Hashes of everything that determines a stage's outputs."""
+    return dict(
+        code={ fn: file_hash(path.join(CODE_DIR,fn)) for fn in local_modules(stage['script']) },
+        inputs={ fn: file_hash(fn) for fn in stage['inputs'] },
+        config=config_hash(stage.get('config',[])),
+        render=config_hash(stage.get('render',[])),
+    )
+
+#########################
+
+
+#######  running  #######
+
+def plan(stage,old,new,force):
+    """What a stage needs: 'run', 'rerender' or 'skip', and why."""
+    if force:
+        return 'run', 'forced'
+    if old is None:
+        return 'run', 'never ran'
+    for fn in stage['outputs']:
+        if file_hash(fn) is None or file_hash(fn) != old['outputs'].get(fn):
+            return 'run', f'{path.basename(fn)} missing or changed'
+    for key in ['code','inputs','config']:
+        if old[key] != new[key]:
+            return 'run', f'{key} changed'
+    if old['render'] != new['render']:
+        if 'rerender' in stage:
+            return 'rerender', 'only output formatting changed'
+        return 'run', 'output formatting changed'
+    return 'skip', 'up to date'
+
+def command(stage,args=[]):
+    script = stage['script']
+    interpreter = ['Rscript'] if script.endswith('.R') else [sys.executable]
+    return interpreter + [script] + args
+
+def start_stage(stage,action):
+    args = stage['rerender'] if action == 'rerender' else []
+    return subprocess.Popen(command(stage,args),cwd=CODE_DIR)
+
+def dependencies(stages):
+    """For each stage, the stages that write any of its inputs."""
+    writers = { fn: stage_name(stage) for stage in stages for fn in stage['outputs'] }
+    return { stage_name(stage): { writers[fn] for fn in stage['inputs'] if fn in writers }
+        for stage in stages }
+
+def load_hashes():
+    if not path.isfile(HASHES_FNAME):
+        return {}
+    with open(HASHES_FNAME) as f:
+        return load(f)
+
+def save_hashes(hashes):
+    # replaced in one go so a crash can't leave half a file
+    tmp_fname = HASHES_FNAME + '.tmp'
+    with open(tmp_fname,'w') as f:
+        dump(hashes,f,indent=4,sort_keys=True)
+    os.replace(tmp_fname,HASHES_FNAME)
+
+#########################
+
+
+#######  in-process mode  #######
+
+# stages that --in-process runs as chained functions
+CHAINED = ['frequencies-generate_freqs','frequencies-indiv_subjs',
+    'frequencies-agg','frequencies-cutoffs',
+    'correlations-resample','correlations-zscore','correlations-plot']
+
+def run_frequencies():
+    import dataset
+    import frequencies
+    freqs = frequencies.lucidity_counts(dataset.load_counts())
+    assert freqs.shape[1] == 6, 'Not all resp options present'
+
+    cumsum_df = frequencies.cumulative_counts(freqs)
+    cumsum_df.to_csv(deriv('ld_freqs-subjs.csv'),index=True)
+    frequencies.plot_subjects(cumsum_df,deriv('ld_freqs-subjs.svg'))
+
+    frequencies.plot_totals(frequencies.total_counts(freqs),deriv('ld_freqs.svg'))
+
+    avgs, anova = frequencies.cutoff_stats(freqs)
+    avgs.to_csv(deriv('ld_freqs-cutoffs_data.csv'),float_format=FLOAT_FMT,index=True,na_rep='NA')
+    anova.to_csv(deriv('ld_freqs-cutoffs_stats.csv'),float_format=FLOAT_FMT,index=False)
+    frequencies.plot_cutoffs(avgs,deriv('ld_freqs-cutoffs_plot.svg'))
+
+def run_correlations(n_jobs):
+    import correlations
+    cols2corr = correlations.probes()
+    df = correlations.load_data()
+    data = correlations.probe_data(df,cols2corr)
+
+    res_df = correlations.resample(data,cols2corr,N_RESAMPLES,n_jobs=n_jobs)
+    res_df = correlations.add_fisherz(res_df)
+    stats_df = correlations.correlation_stats(res_df,
+        correlations.read_exact(deriv('correlates-exact.csv'),data))
+    stats_df.to_csv(deriv('correlates-stats.csv'),float_format=FLOAT_FMT,index=True)
+
+    datadf = correlations.load_data(float_likert=True)
+    correlations.plot_correlations(datadf,stats_df,deriv('correlates-plot.svg'))
+    correlations.plot_fisherz(res_df,stats_df,deriv('correlates-plot_zs.svg'))
+
+def run_in_process(n_jobs):
+    for stage in STAGES:
+        name = stage_name(stage)
+        if name in CHAINED:
+            continue
+        print(f'{name:30s} run',flush=True)
+        if stage['script'].endswith('.R'):
+            subprocess.run(command(stage),cwd=CODE_DIR,check=True)
+        else:
+            sys.argv = [stage['script']]
+            runpy.run_path(path.join(CODE_DIR,stage['script']),run_name='__main__')
+    print(f'{"frequencies (chained)":30s} run',flush=True)
+    run_frequencies()
+    print(f'{"correlations (chained)":30s} run',flush=True)
+    run_correlations(n_jobs)
+
+#################################
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    names = [ stage_name(stage) for stage in STAGES ]
+    for name in args.stages:
+        if name not in names:
+            parser.error(f'unknown stage {name}, pick from: {" ".join(names)}')
+    forced = set(args.stages) if args.stages else (set(names) if args.force else set())
+
+    os.makedirs(DERIV_DIR,exist_ok=True)
+
+    # inherited by every stage, subprocess or not
+    os.environ.setdefault('PHENOLL_HEADLESS','1')
+
+    if args.in_process:
+        t0 = time.monotonic()
+        run_in_process(args.jobs)
+        print(f'total wall time {time.monotonic()-t0:.2f}s')
+        sys.exit()
+
+    hashes = load_hashes()
+
+    if args.dry_run:
+        pending_files = set() # outputs that would get rewritten
+        for stage in STAGES:
+            name = stage_name(stage)
+            action, reason = plan(stage,hashes.get(name),stage_hashes(stage),name in forced)
+            if action == 'skip' and pending_files.intersection(stage['inputs']):
+                action, reason = 'run', 'inputs will change'
+            if action != 'skip':
+                pending_files.update(stage['outputs'])
+            print(f'{name:30s} {action:9s} ({reason})')
+        sys.exit()
+
+    # start each stage once everything it depends on is done,
+    # deciding only then whether it needs to run (its inputs
+    # may have just been rewritten), with up to --jobs at once
+    depends_on = dependencies(STAGES)
+    waiting = list(STAGES)
+    running = {} # name: (stage, process, action, hashes, start time)
+    done = set()
+    failed = []
+    timings = []
+    t0 = time.monotonic()
+
+    while waiting or running:
+
+        # launch whatever is ready
+        for stage in list(waiting):
+            name = stage_name(stage)
+            if failed or len(running) >= args.jobs:
+                break
+            if not depends_on[name] <= done:
+                continue
+            waiting.remove(stage)
+            new = stage_hashes(stage)
+            action, reason = plan(stage,hashes.get(name),new,name in forced)
+            print(f'{name:30s} {action:9s} ({reason})',flush=True)
+            if action == 'skip':
+                done.add(name)
+                timings.append([name,action,f'{time.monotonic()-t0:.2f}',f'{0:.2f}'])
+                continue
+            try:
+                process = start_stage(stage,action)
+            except OSError as error:
+                # eg, Rscript not installed, fails like a crashed stage
+                print(f'{name:30s} could not start ({error})',flush=True)
+                timings.append([name,action,f'{time.monotonic()-t0:.2f}',f'{0:.2f}'])
+                failed.append(name)
+                break
+            running[name] = (stage,process,action,new,time.monotonic())
+
+        if failed and not running:
+            break
+
+        # collect whatever finished
+        time.sleep(POLL_INTERVAL)
+        for name, (stage,process,action,new,start) in list(running.items()):
+            if process.poll() is None:
+                continue
+            del running[name]
+            timings.append([name,action,f'{start-t0:.2f}',f'{time.monotonic()-start:.2f}'])
+            if process.returncode != 0:
+                failed.append(name)
+                continue
+            new['outputs'] = { fn: file_hash(fn) for fn in stage['outputs'] }
+            hashes[name] = new
+            save_hashes(hashes)
+            done.add(name)
+
+    with open(TIMINGS_FNAME,'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['stage','action','start','wall_time'])
+        writer.writerows(timings)
+    print(f'total wall time {time.monotonic()-t0:.2f}s')
+
+    if failed:
+        sys.exit(f'{" ".join(failed)} failed, stopping here')
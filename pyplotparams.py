@@ -1,9 +1,30 @@
 """
 Import at top of any plot scripts to change
 defaults and keep colormaps etc consistent.
+
+Import it before matplotlib.pyplot (and seaborn, which imports
+pyplot), since it picks the backend.
+With the PHENOLL_HEADLESS environment variable set (pipeline.py
+sets it for every stage), plots use the non-interactive Agg
+backend and ion() leaves interactive mode off, so batch runs
+on servers don't need a display. pyplot itself isn't imported
+here, so importing this costs little.
 """
+import os
 import matplotlib
-import matplotlib.pyplot
+import matplotlib.cm
+import matplotlib.patches
+
+
+HEADLESS = os.environ.get('PHENOLL_HEADLESS','0') not in ('','0')
+if HEADLESS:
+    matplotlib.use('Agg')
+
+def ion():
+    """Turn on interactive mode, unless running headless."""
+    if not HEADLESS:
+        import matplotlib.pyplot as plt
+        plt.ion()
 
 
 # change default parameters
@@ -23,7 +44,7 @@ matplotlib.rcParams['svg.fonttype'] = 'none'
 #########  color map and legend stuff  #########
 
 dlqmin, dlqspan = 0, 4
-cmap = matplotlib.pyplot.cm.get_cmap('Blues')
+cmap = matplotlib.cm.get_cmap('Blues')
 dlqcolor = lambda x: cmap((x-dlqmin)/dlqspan)
 
 NORECALL_COLOR = 'gainsboro'
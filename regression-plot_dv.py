@@ -5,10 +5,9 @@ from os import path
 from json import load
 import pandas as pd
 
-import matplotlib.pyplot as plt; plt.ion()
-from matplotlib import ticker as mticker
-
 import pyplotparams as myplt
+import matplotlib.pyplot as plt; myplt.ion()
+from matplotlib import ticker as mticker
 
 
 #########  parameter setup  #########
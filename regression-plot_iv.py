@@ -5,23 +5,21 @@ Each on its own axis.
 
 from os import path
 from json import load
-import pandas as pd
 
-import seaborn as sea
-import matplotlib.pyplot as plt; plt.ion()
-from matplotlib import ticker as mticker
+import dataset
 
 import pyplotparams as myplt
+import seaborn as sea
+import matplotlib.pyplot as plt; myplt.ion()
+from matplotlib import ticker as mticker
 
 
 ########  parameter setup  ########
 
 with open('./config.json') as f:
     p = load(f)
-    DATA_DIR = path.expanduser(p['data_directory'])
     DERIV_DIR = path.expanduser(p['derivatives_directory'])
 
-IMPORT_FNAME = path.join(DATA_DIR,'data.csv')
 EXPORT_FNAME = path.join(DERIV_DIR,'adherence.svg')
 
 PREDICTORS = ['n_reality_checks','MILD_rehearsal_min','MILD_awake_min']
@@ -52,7 +50,8 @@ FIG_WIDTH = 1.5*len(PREDICTORS)
 ########  draw plot  ########
 
 # load data
-df = pd.read_csv(IMPORT_FNAME)
+df = dataset.load_data(columns=['DLQ_01','dream_report']+PREDICTORS,
+    float_likert=True)
 
 # drop all nights without recall
 df.dropna(subset=['dream_report'],axis=0,inplace=True)
@@ -0,0 +1,741 @@
+"""
+Resampling engine for correlations-resample.py.
+
+Each resample draws one random night from every participant.
+Rather than grouping the dataframe and sampling it once per
+resample, the nights are sorted by participant a single time,
+so each participant owns a contiguous block of rows (a start
+offset and a number of nights). All resamples are then drawn
+together as one (n_resamples, n_participants) matrix of row
+indices that can gather any column with fancy indexing.
+
+Resamples are handled in fixed-size blocks, each with its own
+random generator spawned from a SeedSequence keyed by probe and
+block number. So results only depend on the seed, not on how the
+blocks get spread across worker processes. That is a different
+stream than the original groupby/sample script used, so to get
+its exact correlates.csv back, all draws can instead be made up
+front from its RandomState stream (see add_legacy_draws).
+"""
+import os
+import json
+import time
+import hashlib
+from os import path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+
+# what gets saved for every resample
+METRICS = ['slope','intercept','tau']
+
+# number of resamples drawn with a single random generator,
+# kept independent of the number of workers for reproducibility
+BLOCK_SIZE = 1000
+
+# quantiles of the fisher z values used for 95% confidence
+# intervals (same as in correlations-zscore.py)
+CI_QUANTILES = (.025, .975)
+
+# bin width of the tau histogram used as a streaming quantile sketch
+SKETCH_RESOLUTION = 1e-5
+
+
+def participant_blocks(participant_ids):
+    """
+    Get the row order that groups nights by participant,
+    plus the start offset and number of nights of each
+    participant within that order.
+    """
+    participant_ids = np.asarray(participant_ids)
+    order = np.argsort(participant_ids,kind='stable')
+    _, starts, counts = np.unique(participant_ids[order],
+        return_index=True,return_counts=True)
+    return order, starts, counts
+
+
+def draw_nights(starts,counts,n_resamples,rng):
+    """
+    Draw a (n_resamples, n_participants) matrix of row indices,
+    picking one night uniformly at random for each participant.
+    Indices refer to rows already in participant_blocks order.
+    """
+    offsets = rng.integers(0,counts,size=(n_resamples,counts.size))
+    return starts + offsets
+
+
+def legacy_draws(counts,n_resamples,random_state):
+    """
+    Same draws as the original script, which sampled every
+    resample with groupby('participant_id').apply(df.sample(1)).
+    That is the global RandomState's choice(n,1,replace=False) for
+    each participant in turn, ie, the first element of a permutation
+    of their nights, so these calls consume the stream the same way.
+    Offsets are within each participant's block (add the starts).
+    """
+    offsets = np.empty((n_resamples,counts.size),dtype=np.intp)
+    for i in range(n_resamples):
+        offsets[i] = [ random_state.permutation(n)[0] for n in counts ]
+    return offsets
+
+
+def add_legacy_draws(data,seed,n_resamples):
+    """
+    Draw every probe's resamples up front from one RandomState,
+    probe after probe like the original script, so a fixed number
+    of resamples reproduces its correlates.csv for the same seed.
+    The draws are stored with each probe's data (as 'draws') and
+    resample_block takes its rows from them instead of drawing.
+    It's a serial loop and keeps every index in memory, so it's
+    only for checking against the original results.
+    """
+    random_state = np.random.RandomState(seed)
+    for probe in data:
+        probe['draws'] = probe['starts'] + legacy_draws(probe['counts'],
+            n_resamples,random_state)
+    return data
+
+
+def block_rng(seed,probe,block):
+    """
+    Random generator for one block of resamples. Same stream as
+    SeedSequence(seed).spawn(...)[probe].spawn(...)[block] but
+    without having to know the number of probes/blocks up front.
+    """
+    seed_seq = np.random.SeedSequence(seed,spawn_key=(probe,block))
+    return np.random.default_rng(seed_seq)
+
+
+#######  Kendall tau-b for many resamples at once  #######
+
+# above this many participants the pairwise sign
+# comparisons get too big, so switch to merge sort
+MERGESORT_THRESHOLD = 64
+
+# max number of pairwise signs held in memory at once
+PAIRWISE_CHUNK_SIZE = 2**22
+
+
+def kendall_tau_b(x,y,method='auto'):
+    """
+    Kendall tau-b between matching rows of two
+    (n_resamples, n_participants) matrices.
+
+    Ties are corrected for the same way scipy.stats.kendalltau
+    (and so pandas) does it. Rows must not contain NaNs.
+
+    method is 'pairwise' (signs of all pairwise differences),
+    'mergesort' (Knight's O(n log n) algorithm, run on all rows
+    together) or 'auto' to pick based on MERGESORT_THRESHOLD.
+    """
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    assert x.shape == y.shape, 'x and y must have the same shape'
+    if method == 'auto':
+        method = 'pairwise' if x.shape[1] <= MERGESORT_THRESHOLD else 'mergesort'
+    if method == 'pairwise':
+        tau = _kendall_tau_b_pairwise(x,y)
+    elif method == 'mergesort':
+        tau = _kendall_tau_b_mergesort(x,y)
+    else:
+        raise ValueError(f'Unknown method {method}')
+    return np.clip(tau,-1,1)
+
+
+def _kendall_tau_b_pairwise(x,y):
+    n_rows, n = x.shape
+    lo, hi = np.triu_indices(n,k=1)
+    chunk_size = max(1,PAIRWISE_CHUNK_SIZE//max(1,lo.size))
+    numer = np.empty(n_rows)
+    xpairs = np.empty(n_rows)
+    ypairs = np.empty(n_rows)
+    for start in range(0,n_rows,chunk_size):
+        rows = slice(start,start+chunk_size)
+        xsign = np.sign(x[rows,hi]-x[rows,lo])
+        ysign = np.sign(y[rows,hi]-y[rows,lo])
+        # concordant minus discordant pairs
+        numer[rows] = (xsign*ysign).sum(axis=1)
+        # pairs untied in x and in y
+        xpairs[rows] = np.abs(xsign).sum(axis=1)
+        ypairs[rows] = np.abs(ysign).sum(axis=1)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return numer / np.sqrt(xpairs) / np.sqrt(ypairs)
+
+
+def _kendall_tau_b_mergesort(x,y):
+    n = x.shape[1]
+    # sort each row by x, breaking ties in x by y
+    order = np.lexsort((y,x),axis=1)
+    x = np.take_along_axis(x,order,axis=1)
+    y = np.take_along_axis(y,order,axis=1)
+    total = n * (n-1) // 2
+    xtie = _count_tied_pairs(x)
+    ytie = _count_tied_pairs(np.sort(y,axis=1))
+    xytie = _count_tied_pairs(x,y)
+    discordant = _count_inversions(_dense_ranks(y))
+    numer = total - xtie - ytie + xytie - 2*discordant
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return numer / np.sqrt(total-xtie) / np.sqrt(total-ytie)
+
+
+def _count_tied_pairs(*sorted_rows):
+    """
+    Number of tied pairs in each row, where rows are sorted
+    so ties are adjacent. With several arrays a pair only
+    counts as tied if it is tied in all of them.
+    """
+    n_rows, n = sorted_rows[0].shape
+    new_run = np.zeros((n_rows,n),dtype=bool)
+    new_run[:,0] = True
+    for vals in sorted_rows:
+        new_run[:,1:] |= vals[:,1:] != vals[:,:-1]
+    position = np.broadcast_to(np.arange(n),(n_rows,n))
+    run_start = np.maximum.accumulate(np.where(new_run,position,0),axis=1)
+    # every value is tied with the values before it in its run
+    return (position-run_start).sum(axis=1)
+
+
+def _dense_ranks(vals):
+    """Rank each row's values as 0, 1, 2, ... with ties sharing a rank."""
+    order = np.argsort(vals,axis=1,kind='stable')
+    sorted_vals = np.take_along_axis(vals,order,axis=1)
+    sorted_ranks = np.zeros(vals.shape,dtype=np.int64)
+    sorted_ranks[:,1:] = np.cumsum(sorted_vals[:,1:]!=sorted_vals[:,:-1],axis=1)
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks,order,sorted_ranks,axis=1)
+    return ranks
+
+
+def _count_inversions(ranks):
+    """
+    Number of pairs i < j with ranks[i] > ranks[j] in each row,
+    counted with a bottom-up merge sort that merges the blocks
+    of every row in the same pass. Ranks must be ints in [0, n).
+    """
+    n_rows, n = ranks.shape
+    size = 1 << max(0,(n-1).bit_length())
+    # pad up to a power of 2 with a value above every rank
+    vals = np.full((n_rows,size),n,dtype=np.int64)
+    vals[:,:n] = ranks
+    inversions = np.zeros(n_rows,dtype=np.int64)
+    width = 1
+    while width < size:
+        n_blocks = size // (2*width)
+        pairs = vals.reshape(n_rows,n_blocks,2,width)
+        # shift every block pair into its own range of values,
+        # so all of them can be merged with one flat searchsorted
+        block_ids = np.arange(n_rows*n_blocks).reshape(n_rows,n_blocks,1)
+        left = pairs[:,:,0] + block_ids*(n+1)
+        right = pairs[:,:,1] + block_ids*(n+1)
+        block_starts = block_ids * width
+        # left values <= each right value, and right values < each left value
+        right_after = np.searchsorted(left.ravel(),right.ravel(),side='right'
+            ).reshape(right.shape) - block_starts
+        left_after = np.searchsorted(right.ravel(),left.ravel(),side='left'
+            ).reshape(left.shape) - block_starts
+        # a right value jumps over every left value bigger than it
+        inversions += (width-right_after).sum(axis=(1,2))
+        # stable merge by placing each value at its final position
+        within = np.arange(width)
+        positions = np.concatenate([within+left_after,within+right_after],axis=2)
+        merged = np.empty((n_rows,n_blocks,2*width),dtype=np.int64)
+        np.put_along_axis(merged,positions,pairs.reshape(n_rows,n_blocks,2*width),axis=2)
+        vals = merged.reshape(n_rows,size)
+        width *= 2
+    return inversions
+
+
+#######  regression lines for many resamples at once  #######
+
+def linear_fit(x,y,slope=None,intercept=None):
+    """
+    Least squares slope and intercept of y regressed on x,
+    for matching rows of two (n_resamples, n_participants)
+    matrices. Same fit as np.polyfit(x,y,1) on each row, but
+    solved in closed form from the per-row sums of x, y, xy
+    and x^2. Results are written into slope and intercept
+    when they are given (e.g., views of a preallocated array).
+    """
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    n = x.shape[1]
+    sum_x = x.sum(axis=1)
+    sum_y = y.sum(axis=1)
+    sum_xy = np.einsum('ij,ij->i',x,y)
+    sum_xx = np.einsum('ij,ij->i',x,x)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        slope = np.divide(n*sum_xy-sum_x*sum_y,n*sum_xx-sum_x**2,out=slope)
+    intercept = np.divide(sum_y-slope*sum_x,n,out=intercept)
+    return slope, intercept
+
+
+#######  running blocks of resamples, optionally in parallel  #######
+
+def probe_data(participant_ids,x,y):
+    """
+    Arrays needed to resample one probe, with the
+    nights already grouped by participant.
+    """
+    order, starts, counts = participant_blocks(participant_ids)
+    x = np.asarray(x,dtype=float)[order]
+    y = np.asarray(y,dtype=float)[order]
+    return dict(x=x,y=y,starts=starts,counts=counts)
+
+
+def make_blocks(n_probes,n_resamples):
+    """(probe, block, n_resamples) for every block of every probe."""
+    n_blocks = -(-n_resamples // BLOCK_SIZE)
+    return [ (probe,block,min(BLOCK_SIZE,n_resamples-block*BLOCK_SIZE))
+        for probe in range(n_probes) for block in range(n_blocks) ]
+
+
+def resample_block(data,seed,probe,block,n_resamples):
+    """
+    Draw one block of resamples for a probe and get the
+    slope, intercept and tau of each one. data is a list
+    holding the output of probe_data for every probe.
+    """
+    x, y, starts, counts = [ data[probe][key]
+        for key in ('x','y','starts','counts') ]
+    if 'draws' in data[probe]:
+        # drawn up front, see add_legacy_draws
+        first = block * BLOCK_SIZE
+        rsmpl_idx = data[probe]['draws'][first:first+n_resamples]
+    else:
+        rng = block_rng(seed,probe,block)
+        rsmpl_idx = draw_nights(starts,counts,n_resamples,rng)
+    xvals = x[rsmpl_idx]
+    yvals = y[rsmpl_idx]
+    results = np.empty((n_resamples,len(METRICS)))
+    linear_fit(xvals,yvals,slope=results[:,0],intercept=results[:,1])
+    results[:,2] = kendall_tau_b(xvals,yvals)
+    return results
+
+
+class BlockRunner:
+    """
+    Runs resample_block for lists of blocks, returning results in
+    order. With more than 1 job the blocks are spread over a pool of
+    worker processes, which read the data from shared memory instead
+    of each getting a pickled copy. The pool stays up between calls
+    to map, so use it as a context manager to get it cleaned up.
+    """
+    def __init__(self,data,seed,n_jobs=1):
+        self.data = data
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.pool = None
+        self.shm = None
+
+    def __enter__(self):
+        if self.n_jobs > 1:
+            self.shm, layout = _share_arrays(self.data)
+            self.pool = ProcessPoolExecutor(self.n_jobs,initializer=_attach_worker,
+                initargs=(self.shm.name,layout,self.seed))
+        return self
+
+    def __exit__(self,*exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.shm.close()
+            self.shm.unlink()
+
+    def map(self,blocks):
+        if self.pool is None:
+            return ( resample_block(self.data,self.seed,*block) for block in blocks )
+        return self.pool.map(_resample_shared_block,blocks)
+
+
+# what each worker process attaches to
+_worker = {}
+
+def _share_arrays(data):
+    """Copy every probe's arrays into a single block of shared memory."""
+    arrays = [ (i,key,np.ascontiguousarray(arr))
+        for i, probe in enumerate(data) for key, arr in probe.items() ]
+    nbytes = sum( arr.nbytes for _, _, arr in arrays )
+    shm = shared_memory.SharedMemory(create=True,size=max(1,nbytes))
+    layout = [ {} for _ in data ]
+    offset = 0
+    for i, key, arr in arrays:
+        view = np.ndarray(arr.shape,dtype=arr.dtype,buffer=shm.buf,offset=offset)
+        view[:] = arr
+        layout[i][key] = (arr.shape,arr.dtype.str,offset)
+        offset += arr.nbytes
+    return shm, layout
+
+
+def _attach_worker(name,layout,seed):
+    # workers share the parent's resource tracker,
+    # so the parent alone unlinks the block at the end
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['seed'] = seed
+    _worker['data'] = [ { key: np.ndarray(shape,dtype=dtype,buffer=shm.buf,offset=offset)
+            for key, (shape,dtype,offset) in probe.items() }
+        for probe in layout ]
+
+
+def _resample_shared_block(block):
+    return resample_block(_worker['data'],_worker['seed'],*block)
+
+
+#######  exact expectation over all possible draws  #######
+
+def exact_kendall(data):
+    """
+    Expected Kendall statistics over every possible way of picking
+    one night per participant (all draws equally likely), without
+    drawing anything. data is the output of probe_data.
+
+    The tau numerator S (concordant minus discordant pairs) is a sum
+    over participant pairs, and each pair's term only depends on the
+    two nights picked for those participants. So its expectation is
+    the concordance averaged over every night pair of every participant
+    pair. Its variance follows the same way, since two participant
+    pairs only covary when they share a participant. Both take
+    O(total_nights^2) time.
+
+    Returns the expected tau (expected S over the square roots of the
+    expected numbers of untied x and y pairs) and its variance (the
+    variance of S on that same scale).
+    """
+    x, y, starts, counts = [ data[key] for key in ('x','y','starts','counts') ]
+    xsign = np.sign(x[:,None]-x[None,:])
+    ysign = np.sign(y[:,None]-y[None,:])
+    concord = xsign * ysign
+    # mean of each night's terms against every participant's nights
+    concord_vs_pp = np.add.reduceat(concord,starts,axis=1) / counts
+    # expected value of every participant pair's term
+    pair_means = _block_means(concord_vs_pp,starts,counts)
+    pair_sqmeans = _block_means(
+        np.add.reduceat(np.abs(concord),starts,axis=1)/counts,starts,counts)
+    xpair_means = _block_means(
+        np.add.reduceat(np.abs(xsign),starts,axis=1)/counts,starts,counts)
+    ypair_means = _block_means(
+        np.add.reduceat(np.abs(ysign),starts,axis=1)/counts,starts,counts)
+
+    expected = lambda pairs: (pairs.sum()-np.trace(pairs)) / 2
+    numer = expected(pair_means)
+    xpairs = expected(xpair_means)
+    ypairs = expected(ypair_means)
+
+    # variance of S is the sum of every participant pair's variance,
+    # plus covariances between pairs that share a participant
+    pair_vars = pair_sqmeans - pair_means**2
+    variance = expected(pair_vars)
+    owner = np.repeat(np.arange(counts.size),counts)
+    own = concord_vs_pp[np.arange(owner.size),owner]
+    others = concord_vs_pp.sum(axis=1) - own
+    # variance over each participant's nights of their summed terms,
+    # minus the variance of every term on its own
+    variance += ( _block_vars(others,starts,counts)
+        - (_block_vars(concord_vs_pp,starts,counts).sum(axis=1)
+           - _block_vars(own,starts,counts)) ).sum()
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        tau = numer / np.sqrt(xpairs) / np.sqrt(ypairs)
+        tau_var = variance / xpairs / ypairs
+    return tau, tau_var
+
+
+def _block_means(vals,starts,counts):
+    """Average rows within each participant's block of nights."""
+    return (np.add.reduceat(vals,starts,axis=0).T / counts).T
+
+
+def _block_vars(vals,starts,counts):
+    """Variance (ddof=0) of rows within each participant's block of nights."""
+    means = _block_means(vals,starts,counts)
+    return _block_means(vals**2,starts,counts) - means**2
+
+
+#######  adaptive number of resamples  #######
+
+def fisherz(tau):
+    """
+    Fisher z transform. arctanh can't handle -1 or 1 so pull
+    those in by .000001 (the precision of other values).
+    """
+    return np.arctanh(np.clip(tau,-1+1e-6,1-1e-6))
+
+
+def monte_carlo_error(fishz):
+    """
+    Largest Monte Carlo standard error among the statistics taken
+    from resampled fisher z values: their mean, the CI_QUANTILES
+    bounds and the two-tailed sign pvalue. The error of a quantile
+    is half the spread of the order statistics within one binomial
+    standard deviation of its rank.
+    """
+    n = fishz.size
+    errors = [ fishz.std(ddof=1) / np.sqrt(n) ]
+    fishz = np.sort(fishz)
+    for q in CI_QUANTILES:
+        spread = np.sqrt(n*q*(1-q))
+        lo = int(max(0,np.floor(n*q-spread)))
+        hi = int(min(n-1,np.ceil(n*q+spread)))
+        errors.append( (fishz[hi]-fishz[lo]) / 2 )
+    smaller = min(np.mean(fishz>0),np.mean(fishz<0))
+    errors.append( 2 * np.sqrt(smaller*(1-smaller)/n) )
+    return max(errors)
+
+
+def run_adaptive(runner,n_probes,tolerance,max_resamples,store):
+    """
+    Keep drawing blocks of resamples for each probe until the Monte
+    Carlo error of its fisher z statistics drops to the tolerance,
+    or it reaches max_resamples. Blocks are numbered the same as in
+    make_blocks, so a probe's resamples match the start of a fixed
+    run with the same seed. Every block is appended to the store,
+    and any resamples already in it are picked up where they left off.
+    """
+    results = [ [store.read_probe(k)] for k in range(n_probes) ]
+    n_done = np.array([ len(res[0]) for res in results ])
+    def unfinished(k):
+        if n_done[k] == 0:
+            return True
+        fishz = fisherz(np.concatenate(results[k])[:,2])
+        return n_done[k] < max_resamples and monte_carlo_error(fishz) > tolerance
+    active = [ k for k in range(n_probes) if unfinished(k) ]
+    while active:
+        blocks = [ (k,n_done[k]//BLOCK_SIZE,min(BLOCK_SIZE,max_resamples-n_done[k]))
+            for k in active ]
+        for (k,b,n), block_res in zip(blocks,runner.map(blocks)):
+            store.append(k,b,block_res)
+            results[k].append(block_res)
+            n_done[k] += n
+        active = [ k for k in active if unfinished(k) ]
+
+
+#######  summary stats  #######
+
+def resample_stats(res_df,quantiles=CI_QUANTILES):
+    """
+    Per-probe stats of a resample table with a fishz column: mean of
+    every column, fisher z CI bounds (quantiles interpolated like
+    pandas) and the two-tailed sign pvalue. Rows are sorted once by
+    probe and fisher z, then everything comes from reductions over
+    each probe's segment instead of separate groupby passes. Also
+    returns the number of resamples of each probe.
+    """
+    codes, probes = pd.factorize(res_df.index.get_level_values('probe'),sort=True)
+    fishz = res_df['fishz'].values
+    # NaNs sort to the end of each probe's segment
+    order = np.lexsort((fishz,codes))
+    starts = np.searchsorted(codes[order],np.arange(len(probes)))
+    counts = np.diff(np.append(starts,len(codes)))
+    values = res_df.values[order]
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore'):
+        means = ( np.add.reduceat(np.where(valid,values,0),starts,axis=0)
+            / np.add.reduceat(valid,starts,axis=0) )
+    stats_df = pd.DataFrame(means,columns=[ f'{c}_mean' for c in res_df.columns ],
+        index=pd.Index(probes,name='probe'))
+    # quantiles from the sorted fisher z values of each probe
+    fishz = fishz[order]
+    n_valid = np.add.reduceat(~np.isnan(fishz),starts)
+    for q, col in zip(quantiles,['fishz_cilo','fishz_cihi']):
+        # probes without any valid value get NaN bounds
+        # (clipped so they don't index the previous probe)
+        position = np.maximum(n_valid-1,0) * q
+        lo = starts + np.floor(position).astype(int)
+        hi = starts + np.ceil(position).astype(int)
+        bounds = fishz[lo] + (position-np.floor(position)) * (fishz[hi]-fishz[lo])
+        stats_df[col] = np.where(n_valid>0,bounds,np.nan)
+    # p = % of values > or < 0
+    # double the smaller p value (bc two-tailed test)
+    proportion_above = np.add.reduceat(fishz>0,starts) / counts
+    proportion_below = np.add.reduceat(fishz<0,starts) / counts
+    stats_df['pval'] = 2 * np.minimum(proportion_above,proportion_below)
+    n_resamples = pd.Series(counts,index=stats_df.index)
+    return stats_df, n_resamples
+
+
+def finish_stats(stats_df,n_resamples,exact_df=None):
+    """
+    Finish off the per-probe stats (means, CI bounds and pvalue
+    of the resamples). Adds the exact expected tau next to the
+    resampled one if given (from correlations-resample.py --exact),
+    FDR corrected pvalues and the number of resamples used, then
+    orders everything by correlation effect.
+    """
+    # imported here so worker processes don't have to load it
+    from statsmodels.stats.multitest import fdrcorrection
+    stats_df = stats_df.copy()
+    # put the exact expected tau right next to the resampled mean
+    if exact_df is not None:
+        loc = stats_df.columns.get_loc('tau_mean') + 1
+        for i, col in enumerate(exact_df.columns):
+            stats_df.insert(loc+i,col,exact_df[col])
+    # generate a pvalue accounting for multiple comparisons
+    uncorrected_pvals = stats_df['pval'].values
+    _, corrp = fdrcorrection(uncorrected_pvals,method='indep',is_sorted=False)
+    stats_df['pval_corrected'] = corrp
+    # number of resamples actually used (differs with --adaptive resampling)
+    stats_df['n_resamples'] = n_resamples
+    return stats_df.sort_values('pval',ascending=True)
+
+
+class StreamingStats:
+    """
+    Summary stats of one probe's resamples, updated a block at a
+    time so the resamples never need to be kept around. Running
+    sums give the means and sign counts give the pvalue. The CI
+    bounds come from a quantile sketch, a histogram of tau with
+    SKETCH_RESOLUTION wide bins. Fisher z is monotonic, so the
+    order statistics of tau are those of fisher z, which are
+    interpolated like pandas quantiles (off by at most half a bin).
+    """
+    def __init__(self):
+        self.n = 0
+        self.n_valid = np.zeros(len(METRICS)+1,dtype=np.int64)
+        self.sums = np.zeros(len(METRICS)+1)
+        self.n_above = 0
+        self.n_below = 0
+        self.hist = np.zeros(int(round(2/SKETCH_RESOLUTION))+1,dtype=np.int64)
+
+    def update(self,results):
+        tau = results[:,METRICS.index('tau')]
+        fishz = fisherz(tau)
+        values = np.column_stack([results,fishz])
+        self.n += len(results)
+        self.n_valid += np.sum(~np.isnan(values),axis=0)
+        self.sums += np.nansum(values,axis=0)
+        self.n_above += np.sum(fishz>0)
+        self.n_below += np.sum(fishz<0)
+        tau = tau[~np.isnan(tau)]
+        bins = np.rint((tau+1)/SKETCH_RESOLUTION).astype(np.int64)
+        self.hist += np.bincount(bins,minlength=self.hist.size)
+
+    def quantile(self,q):
+        """Fisher z quantile, linearly interpolated between order statistics."""
+        if self.hist.sum() == 0:
+            return np.nan # no valid tau at all
+        position = (self.hist.sum()-1) * q
+        ranks = [ np.floor(position), np.ceil(position) ]
+        # bins holding those order statistics
+        bins = np.searchsorted(np.cumsum(self.hist),ranks,side='right')
+        lo, hi = fisherz(bins*SKETCH_RESOLUTION-1)
+        return lo + (position-ranks[0]) * (hi-lo)
+
+    def summary(self):
+        with np.errstate(invalid='ignore'):
+            means = self.sums / self.n_valid
+        summ = { f'{c}_mean': m for c, m in zip(METRICS+['fishz'],means) }
+        summ['fishz_cilo'], summ['fishz_cihi'] = [ self.quantile(q)
+            for q in CI_QUANTILES ]
+        # p = % of values > or < 0
+        # double the smaller p value (bc two-tailed test)
+        summ['pval'] = 2 * min(self.n_above,self.n_below) / self.n
+        return summ
+
+
+#######  streaming results to disk  #######
+
+# min seconds between checkpoints while streaming resamples
+CHECKPOINT_INTERVAL = 10
+
+class ResampleStore:
+    """
+    Appendable columnar store of resample results on disk. Every
+    column (probe, resample and the METRICS) is a raw binary file
+    that each finished block gets appended to. A checkpoint file
+    records the number of rows written and the completed blocks,
+    saved every CHECKPOINT_INTERVAL seconds once the blocks' data
+    is flushed. So after an interrupted run, resuming drops anything
+    written after the checkpoint and carries on from it (redoing the
+    blocks since). The settings that determine the results are saved
+    too, so a resume can't mix results from different settings, and
+    column files shorter than the checkpoint are an error.
+    """
+    COLUMNS = [ ('probe','<i4'), ('resample','<i8') ] + [ (m,'<f8') for m in METRICS ]
+
+    def __init__(self,directory,settings,resume=False):
+        self.directory = directory
+        self.checkpoint_fname = path.join(directory,'checkpoint.json')
+        self.last_saved = time.monotonic()
+        if resume and path.isfile(self.checkpoint_fname):
+            with open(self.checkpoint_fname) as f:
+                self.checkpoint = json.load(f)
+            if self.checkpoint['settings'] != settings:
+                raise ValueError('Resample checkpoint was written with different '
+                    'settings or data, so it can not be resumed')
+        else:
+            os.makedirs(directory,exist_ok=True)
+            self.checkpoint = dict(settings=settings,n_rows=0,completed=[],
+                last_probe=None,last_block=None,finished=False)
+            self._save_checkpoint()
+        # drop anything written after the last checkpoint
+        self.files = {}
+        for col, dtype in self.COLUMNS:
+            fname = path.join(directory,f'{col}.bin')
+            nbytes = self.checkpoint['n_rows'] * np.dtype(dtype).itemsize
+            if nbytes > 0 and (not path.isfile(fname) or path.getsize(fname) < nbytes):
+                raise ValueError(f'{fname} is missing rows the checkpoint '
+                    'says were written, so the run can not be resumed')
+            f = open(fname,'ab')
+            f.truncate(nbytes)
+            self.files[col] = f
+
+    @property
+    def completed(self):
+        """(probe, block) of every block already stored."""
+        return { tuple(pb) for pb in self.checkpoint['completed'] }
+
+    @property
+    def finished(self):
+        return self.checkpoint['finished']
+
+    def append(self,probe,block,results):
+        n = len(results)
+        columns = dict(probe=np.full(n,probe),
+            resample=block*BLOCK_SIZE+np.arange(n))
+        columns.update(zip(METRICS,results.T))
+        for col, dtype in self.COLUMNS:
+            f = self.files[col]
+            f.write(np.asarray(columns[col],dtype=dtype).tobytes())
+            f.flush()
+        self.checkpoint['n_rows'] += n
+        self.checkpoint['completed'].append([int(probe),int(block)])
+        self.checkpoint['last_probe'] = int(probe)
+        self.checkpoint['last_block'] = int(block)
+        if time.monotonic() - self.last_saved > CHECKPOINT_INTERVAL:
+            self._save_checkpoint()
+
+    def finish(self):
+        self.checkpoint['finished'] = True
+        self._save_checkpoint()
+        for f in self.files.values():
+            f.close()
+
+    def read_column(self,col):
+        dtype = dict(self.COLUMNS)[col]
+        fname = path.join(self.directory,f'{col}.bin')
+        return np.fromfile(fname,dtype=dtype,count=self.checkpoint['n_rows'])
+
+    def read_probe(self,probe):
+        """(n_resamples, n_metrics) results of one probe, in resample order."""
+        rows = np.flatnonzero(self.read_column('probe')==probe)
+        rows = rows[np.argsort(self.read_column('resample')[rows],kind='stable')]
+        return np.column_stack([ self.read_column(m)[rows] for m in METRICS ])
+
+    def _save_checkpoint(self):
+        # write then rename, so the checkpoint is never half written
+        tmp_fname = self.checkpoint_fname + '.tmp'
+        with open(tmp_fname,'w') as f:
+            json.dump(self.checkpoint,f)
+        os.replace(tmp_fname,self.checkpoint_fname)
+        self.last_saved = time.monotonic()
+
+
+def data_hash(data):
+    """Fingerprint of every probe's arrays, to tell if the data changed."""
+    sha = hashlib.sha1()
+    for probe in data:
+        for key in sorted(probe):
+            sha.update(np.ascontiguousarray(probe[key]).tobytes())
+    return sha.hexdigest()
@@ -0,0 +1,137 @@
+"""
+Search the dream reports and open question responses,
+instead of scrolling through the group_openquestions.py files.
+
+The build command saves a full text (inverted) index of every
+night with recall, with the dream report and each INTERR
+response as separate columns, and the night's participant and
+DLQ1 response stored next to them to filter on. It's an SQLite
+FTS5 table, so it's a single file and needs nothing installed.
+Building again only adds the nights that aren't in it yet
+(eg, after xls2csv.py --append), unless --rebuild is given.
+
+The query command takes anything FTS5 understands:
+    python search_openquestions.py build
+    python search_openquestions.py query flying
+    python search_openquestions.py query '"a dog"'                  # phrase
+    python search_openquestions.py query 'flying NOT water OR falling' # boolean
+    python search_openquestions.py query 'fly*' --lucidity 3 4      # prefix, only DLQ1 3 or 4
+    python search_openquestions.py query mirror --probe INTERR_2 --participant 818
+and lists every matching night with its DLQ1 response
+and a snippet of the best matching text.
+"""
+from os import path
+from json import load
+import sqlite3
+import argparse
+
+
+######  parameter setup  ######
+
+with open('./config.json') as f:
+    p = load(f)
+    DERIV_DIR = path.expanduser(p['derivatives_directory'])
+
+INDEX_FNAME = path.join(DERIV_DIR,'open_questions.sqlite')
+
+TEXT_COLS = ['dream_report','INTERR_1','INTERR_2','INTERR_3','INTERR_4']
+
+SNIPPET_TOKENS = 12 # words of context around the matches
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command',required=True)
+build_parser = subparsers.add_parser('build',help='index the nights that are new')
+build_parser.add_argument('--rebuild',action='store_true',
+    help='start the index over instead of adding to it')
+query_parser = subparsers.add_parser('query',help='list the nights that match a query')
+query_parser.add_argument('query',
+    help='FTS5 query, eg: flying, "a dog", flying NOT water, fly*')
+query_parser.add_argument('-l','--lucidity',type=int,nargs='+',
+    help='only nights with these DLQ1 responses')
+query_parser.add_argument('-p','--participant',nargs='+',
+    help='only nights of these participants')
+query_parser.add_argument('--probe',nargs='+',choices=TEXT_COLS,
+    help='only search these columns (default is all of them)')
+query_parser.add_argument('-n','--limit',type=int,default=None,
+    help='only list the best N matches')
+
+################################
+
+
+def connect():
+    connection = sqlite3.connect(INDEX_FNAME)
+    connection.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS reports USING fts5(
+        night_id UNINDEXED, participant_id UNINDEXED, DLQ_01 UNINDEXED,
+        {", ".join(TEXT_COLS)})''')
+    # every night already looked at, with recall or not, so
+    # later builds can tell which ones are new without the index
+    connection.execute('CREATE TABLE IF NOT EXISTS nights (night_id TEXT PRIMARY KEY)')
+    return connection
+
+def build(rebuild=False):
+    import dataset # pandas only for building, queries start faster without it
+    if rebuild and path.isfile(INDEX_FNAME):
+        with sqlite3.connect(INDEX_FNAME) as connection:
+            connection.execute('DROP TABLE IF EXISTS reports')
+            connection.execute('DROP TABLE IF EXISTS nights')
+    connection = connect()
+    indexed = { night_id for (night_id,) in connection.execute('SELECT night_id FROM nights') }
+
+    df = dataset.load_data(columns=['participant_id','night_id','DLQ_01']+TEXT_COLS)
+    df['night_id'] = df['night_id'].astype(str)
+    df = df[~df['night_id'].isin(indexed)]
+    new_nights = df['night_id'].tolist()
+
+    # only nights with recall have anything to search
+    df = df.dropna(subset=['dream_report'])
+    rows = ( ( row[0], str(row[1]), int(row[2]), *[ None if x != x or x is None else x for x in row[3:] ] )
+        for row in df[['night_id','participant_id','DLQ_01']+TEXT_COLS].itertuples(index=False) )
+    with connection:
+        connection.executemany(f'INSERT INTO reports VALUES ({", ".join("?"*(3+len(TEXT_COLS)))})',rows)
+        connection.executemany('INSERT INTO nights VALUES (?)',[ (n,) for n in new_nights ])
+    n_indexed = connection.execute('SELECT count(*) FROM reports').fetchone()[0]
+    connection.close()
+    print(f'{len(df)} new nights with recall indexed ({n_indexed} in total)')
+
+def search(query,lucidity=None,participant=None,probe=None,limit=None):
+    """(night_id, participant_id, DLQ_01, snippet) of matching nights, best first."""
+    if probe:
+        # FTS5 column filter
+        query = f'{{{" ".join(probe)}}} : ({query})'
+    sql = f'''SELECT night_id, participant_id, DLQ_01,
+        snippet(reports,-1,'[',']','...',{SNIPPET_TOKENS})
+        FROM reports WHERE reports MATCH ?'''
+    params = [query]
+    if lucidity:
+        sql += f' AND DLQ_01 IN ({",".join("?"*len(lucidity))})'
+        params += lucidity
+    if participant:
+        sql += f' AND participant_id IN ({",".join("?"*len(participant))})'
+        params += participant
+    sql += ' ORDER BY rank'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    connection = sqlite3.connect(f'file:{INDEX_FNAME}?mode=ro',uri=True)
+    try:
+        return connection.execute(sql,params).fetchall()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.rebuild)
+    else:
+        if not path.isfile(INDEX_FNAME):
+            parser.exit(1,f'No index at {INDEX_FNAME}, run the build command first\n')
+        try:
+            results = search(args.query,args.lucidity,args.participant,args.probe,args.limit)
+        except sqlite3.OperationalError as error:
+            parser.exit(1,f'Bad query: {error}\n')
+        for night_id, participant_id, dlq, snippet in results:
+            print(f'{night_id}\tDLQ1={dlq}\t{snippet}')
+        print(f'{len(results)} matching nights')
@@ -7,11 +7,46 @@ Also do some other tidying things:
     - Replace non-dream entries with explicit NA representation.
     - Add a new column <session_id> that denotes the entry number for that participant.
     - Add a new column <night_id> that provides a unique id for every entry (combination of participant_id and the session_id).
+
+With --input, read many exports at once (eg, one per collection
+wave and site) from a directory or glob of Excel/CSV files instead
+of the single data-clean.xls. Files are read in parallel with --jobs
+processes, and .xlsx files are streamed row by row in read-only
+mode, so the workbook itself is never loaded whole. The exports get
+the same tidying and are merged in sorted filename order, and
+sessions are numbered over all files so each participant gets one
+consistent set of ids. The exports have no key that identifies a
+night, so every row is kept. Rows identical to a row of an earlier
+file (eg, from overlapping waves) are listed so they can be checked.
+
+With --append, data.csv is not rebuilt. Instead only the rows each
+export gained since the last run get appended, continuing each
+participant's session_id numbering. Exports are told apart by file
+name, and data-exports.json (next to data.csv) records how many rows
+of each are in data.csv already, with a fingerprint of them. So an
+export that changed in those rows, instead of only growing at the
+end, is an error rather than a guess at which nights are new.
+
+Either way, the participants whose nights changed are listed in
+data-updated_participants.txt, so later steps can update just
+those (eg, frequencies-generate_freqs.py --update).
+
+Besides data.csv, also save the typed columnar copy
+of it that all the other scripts load (see dataset.py).
 """
 from os import path
-from json import load
+from json import load, dump
+import io
+import hashlib
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+
+import numpy as np
 import pandas as pd
 
+import dataset
+
 
 with open('./config.json') as f:
     p = load(f)
@@ -19,29 +54,200 @@ with open('./config.json') as f:
 
 IMPORT_FNAME = path.join(DATA_DIR,'data-clean.xls')
 EXPORT_FNAME = path.join(DATA_DIR,'data.csv')
+INGESTED_FNAME = path.join(DATA_DIR,'data-exports.json') # rows of each export in data.csv
+
+ID_COLS = ['session_id','night_id'] # added here, not part of the exports
+CSV_FLOAT_FMT = '%.0f'
+
+EXPORT_EXTENSIONS = ['.xls','.xlsx','.csv']
+STREAM_CHUNK_ROWS = 10000 # rows per dataframe chunk when streaming .xlsx
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-i','--input',default=None,
+    help='directory or glob of Excel/CSV exports to merge (default is data-clean.xls)')
+parser.add_argument('-j','--jobs',type=int,default=1,
+    help='number of processes to read the exports with')
+parser.add_argument('--append',action='store_true',
+    help='only add nights that are not in data.csv yet')
+
+
+def read_xlsx_streaming(fname):
+    """Read the first sheet of an .xlsx file row by row, only
+    holding a chunk of raw rows at a time (the dataframe of the
+    whole sheet still ends up in memory)."""
+    import openpyxl
+    workbook = openpyxl.load_workbook(fname,read_only=True,data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows)
+        chunks = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == STREAM_CHUNK_ROWS:
+                chunks.append(pd.DataFrame.from_records(chunk,columns=header))
+                chunk = []
+        chunks.append(pd.DataFrame.from_records(chunk,columns=header))
+    finally:
+        workbook.close()
+    return pd.concat(chunks,ignore_index=True).infer_objects()
+
+def read_export(fname):
+    """Load one export and do the per-night tidying."""
+    if fname.endswith('.csv'):
+        df = pd.read_csv(fname)
+    elif fname.endswith('.xlsx'):
+        df = read_xlsx_streaming(fname)
+    else:
+        df = pd.read_excel(fname)
+    df.set_index('participant_id',inplace=True)
+
+    # subtract 1 from all Likert scale responses,
+    # and make sure they fit the declared number of levels
+    likert_cols = [ col for col in df.columns if dataset.is_likert(col) ]
+    df[likert_cols] -= 1
+    for block, n_levels in dataset.LIKERT_BLOCKS.items():
+        block_cols = [ col for col in likert_cols if dataset.likert_block(col) == block ]
+        values = df[block_cols].to_numpy(dtype=float)
+        assert np.all(np.isnan(values) | ((values >= 0) & (values < n_levels))), \
+            f'{block} responses out of range in {fname}'
+
+    # clearly indicate rows without dream recall by making them NAs so easier to drop later
+    df.replace(dict(dream_report={'No recall':pd.NA}),inplace=True)
+    return df
+
+def find_exports(pattern):
+    """All exports in a directory or matching a glob, in sorted order."""
+    if path.isdir(pattern):
+        pattern = path.join(pattern,'*')
+    fnames = sorted( fn for fn in glob(path.expanduser(pattern))
+        if path.splitext(fn)[1].lower() in EXPORT_EXTENSIONS )
+    assert fnames, f'No Excel/CSV exports found for {pattern}'
+    return fnames
+
+def row_hashes(df):
+    """One hash per row, of the participant and all its responses."""
+    return pd.util.hash_pandas_object(df,index=True).values
+
+def merge_exports(exports,fnames,skipped_rows=None):
+    """Stack the exports, keeping every row as a night. Two nights
+    can have the same responses (eg, repeated "No recall" nights),
+    so rows identical to a row of an earlier file are only listed
+    (as row numbers of their file, after any skipped_rows at the
+    start of it), not dropped."""
+    if len(exports) == 1:
+        return exports[0]
+    df = pd.concat(exports,axis=0,sort=False)
+    hashes = row_hashes(df)
+    file_index = np.repeat(np.arange(len(exports)),[ len(x) for x in exports ])
+    first_file = pd.Series(file_index).groupby(hashes).transform('min').values
+    if skipped_rows is None:
+        skipped_rows = [0] * len(exports)
+    file_rows = np.concatenate([ n + np.arange(len(x)) for x, n in zip(exports,skipped_rows) ])
+    for i in np.unique(file_index[file_index > first_file]):
+        repeats = (file_index == i) & (first_file < i)
+        # +2 for the header and to count from 1, like a spreadsheet
+        rows = ' '.join( str(r+2) for r in file_rows[repeats] )
+        print(f'{path.basename(fnames[i])}: {repeats.sum()} nights identical to '
+            f'nights of an earlier export, kept anyway (rows {rows})')
+    return df
+
+def as_csv_text(df):
+    """Every field as the text it gets in data.csv."""
+    buffer = io.StringIO()
+    df.to_csv(buffer,index=True,float_format=CSV_FLOAT_FMT,na_rep='NA')
+    buffer.seek(0)
+    return pd.read_csv(buffer,dtype=str,keep_default_na=False,
+        index_col='participant_id')
+
+def rows_digest(df):
+    """Fingerprint of some nights, as their text in data.csv
+    (so it doesn't depend on the dtypes they parse to)."""
+    return hashlib.sha1(row_hashes(as_csv_text(df)).tobytes()).hexdigest()
+
+def add_ids(df,previous_sessions=0):
+    # add session_id column denoting the nth entry within each subject
+    # (after any sessions they already had)
+    df['session_id'] = df.groupby(level='participant_id').cumcount() + 1 + previous_sessions
+
+    # create a night_id that has subject and night in it,
+    # only converting each participant (and session number) to text once
+    participants = pd.Categorical(df.index)
+    pp_strings = participants.categories.astype(str).to_numpy(dtype=object)
+    session_strings = np.arange(df['session_id'].max()+1).astype(str).astype(object)
+    night_ids = pp_strings[participants.codes] + '-' + session_strings[df['session_id'].values]
+    df['night_id'] = pd.Categorical(night_ids)
+    return df
+
+
+# guard so worker processes can import this file without rerunning it
+if __name__ == '__main__':
+
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    # load data
+    fnames = [IMPORT_FNAME] if args.input is None else find_exports(args.input)
+    if args.jobs > 1 and len(fnames) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            exports = list(pool.map(read_export,fnames))
+    else:
+        exports = [ read_export(fn) for fn in fnames ]
+
+    appending = args.append and path.isfile(EXPORT_FNAME)
+    if appending:
+        if not path.isfile(INGESTED_FNAME):
+            parser.error(f'{INGESTED_FNAME} is missing, so it is unknown which '
+                'nights data.csv already has, run once without --append')
+        with open(INGESTED_FNAME) as f:
+            ingested = load(f)
+    else:
+        ingested = {}
 
+    # only the rows past the ones already in data.csv are new
+    new_exports, skipped_rows = [], []
+    for fn, export in zip(fnames,exports):
+        name = path.basename(fn)
+        n_old = ingested[name]['n_rows'] if name in ingested else 0
+        if n_old > len(export) or (n_old > 0
+                and rows_digest(export.iloc[:n_old]) != ingested[name]['digest']):
+            raise ValueError(f'{name} changed in nights that are already in '
+                'data.csv, rebuild it without --append')
+        new_exports.append(export.iloc[n_old:].copy())
+        skipped_rows.append(n_old)
+        ingested[name] = dict(n_rows=len(export),digest=rows_digest(export))
 
-# load data
-df = pd.read_excel(IMPORT_FNAME,index_col='participant_id')
+    df = merge_exports(new_exports,fnames,skipped_rows)
 
-# subtract 1 from all Likert scale responses
-likert_cols = [ col for col in df.columns
-    if ('PANAS' in col
-     or 'DLQ'   in col
-     or 'MUSK'  in col
-     or 'CHAR'  in col) ]
-df[likert_cols] -= 1
+    if appending:
+        columns = pd.read_csv(EXPORT_FNAME,index_col='participant_id',nrows=0).columns
+        content_cols = [ col for col in columns if col not in ID_COLS ]
+        assert set(content_cols) == set(df.columns), \
+            'Exports have different columns than data.csv'
+        df = df[content_cols].copy()
 
-# clearly indicate rows without dream recall by making them NAs so easier to drop later
-df.replace(dict(dream_report={'No recall':pd.NA}),inplace=True)
+        if len(df) > 0:
+            # continue numbering from each participant's last session
+            old_ids = pd.read_csv(EXPORT_FNAME,usecols=['participant_id','session_id'],
+                dtype={'participant_id':str},index_col='participant_id')
+            n_sessions = old_ids['session_id'].groupby(level='participant_id').max()
+            previous_sessions = n_sessions.reindex(df.index.astype(str)).fillna(0).astype(int).values
+            df = add_ids(df,previous_sessions)
+            df.to_csv(EXPORT_FNAME,mode='a',header=False,index=True,
+                float_format=CSV_FLOAT_FMT,na_rep='NA')
+    else:
+        df = add_ids(df)
+        df.to_csv(EXPORT_FNAME,index=True,float_format=CSV_FLOAT_FMT,na_rep='NA')
 
-# add session_id column denoting the nth entry within each subject
-df['session_id'] = pd.NA
-for pp, n_sessions in df.index.value_counts().items():
-    df.loc[pp,'session_id'] = range(1,n_sessions+1)
+    with open(INGESTED_FNAME,'w') as f:
+        dump(ingested,f,indent=4)
 
-# create a night_id that has subject and night in it
-df['night_id'] = df.index.astype(str) + '-' + df['session_id'].astype(str)
+    # list who has new nights
+    updated = df.index.unique()
+    with open(dataset.UPDATED_FNAME,'w') as f:
+        f.writelines( f'{pp}\n' for pp in updated )
+    print(f'{len(df)} new nights from {len(updated)} participants')
 
-# save
-df.to_csv(EXPORT_FNAME,index=True,float_format='%.0f',na_rep='NA')
\ No newline at end of file
+    if len(df) > 0 or not dataset.cache_is_current():
+        dataset.write_cache()